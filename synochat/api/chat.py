@@ -1,17 +1,61 @@
 import json
 import logging
-from typing import Any, Dict
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
 
+import metrics
+from api import coalesce, outbound, session
+
 
 class WebhookPostService:
-    def __init__(self, incoming_webhook_url) -> None:
+    """Posts to an incoming webhook through an outbound queue
+
+    With a `coalesce_window` and a threaded queue, messages to the same
+    recipients sent within the window are merged into one post of at most
+    `max_chars` characters (see coalesce.Coalescer). Inline queues send
+    every message at once.
+    """
+
+    def __init__(
+        self,
+        incoming_webhook_url,
+        http: Optional[session.HttpSession] = None,
+        queue: Optional[outbound.OutboundQueue] = None,
+        max_recipients: int = 50,
+        coalesce_window: float = 0.0,
+        max_chars: int = coalesce.MAX_TEXT,
+    ) -> None:
         self.income_wh_url: str = incoming_webhook_url
+        self.max_recipients: int = max_recipients
+        self.http: session.HttpSession = http if http else session.HttpSession()
+        # no queue means sending inline in the caller
+        self.queue: outbound.OutboundQueue = (
+            queue if queue else outbound.OutboundQueue(workers=0)
+        )
+        self.coalescer: Optional[coalesce.Coalescer] = (
+            coalesce.Coalescer(
+                self._submit, coalesce_window, max_chars, name=self.queue.name
+            )
+            if coalesce_window > 0 and self.queue.workers > 0
+            else None
+        )
 
     def send_message(
         self, response_text: str = "", user_id: int = -1, file_url: str = ""
-    ) -> None:
+    ) -> Future:
+        """Queue a message and return immediately
+
+        Args:
+            response_text (str): message text
+            user_id (int): recipient, -1 to post to the webhook's channel
+            file_url (str): optional attachment url
+
+        Returns:
+            Future: resolves to True once Synology accepted the post, or to
+                the raised exception when sending failed
+        """
         message: Dict[str, Any] = {
             "text": response_text,
         }
@@ -21,34 +65,103 @@ class WebhookPostService:
         if file_url:
             message["file_url"] = file_url
 
+        return self._send(message)
+
+    def send_batch(
+        self, messages: Iterable[Tuple[int, str]], file_url: str = ""
+    ) -> List[Future]:
+        """Send (user_id, text) pairs, merging identical texts into one post
+
+        Recipients of the same text share a single post through `user_ids`,
+        split into posts of at most `max_recipients` users. A post only
+        groups users of one outbound shard, so it stays in order with the
+        other posts to each of its recipients.
+
+        Args:
+            messages (Iterable[Tuple[int, str]]): recipient and text pairs
+            file_url (str): optional attachment url for every post
+
+        Returns:
+            List[Future]: one future per post actually sent
+        """
+        groups: Dict[Tuple[str, int], List[int]] = {}
+        for user_id, text in messages:
+            shard: int = self.queue.shard_of(int(user_id))
+            groups.setdefault((text, shard), []).append(int(user_id))
+
+        futures: List[Future] = []
+        step: int = max(1, self.max_recipients)
+        for (text, _shard), user_ids in groups.items():
+            for start in range(0, len(user_ids), step):
+                message: Dict[str, Any] = {
+                    "text": text,
+                    "user_ids": user_ids[start : start + step],
+                }
+                if file_url:
+                    message["file_url"] = file_url
+                futures.append(self._send(message))
+        return futures
+
+    def _send(self, message: Dict[str, Any]) -> Future:
+        if self.coalescer is not None:
+            return self.coalescer.add(message)
+        return self._submit(message)
+
+    def _submit(self, message: Dict[str, Any], block: bool = True) -> Future:
+        # the first recipient routes the post, -1 for the channel; batches
+        # only group recipients of one shard, see send_batch
+        user_ids: List[int] = message.get("user_ids", [-1])
+        return self.queue.submit(
+            lambda: self._post(message), key=user_ids[0], block=block
+        )
+
+    def flush(self) -> None:
+        """Hand messages still waiting for their coalescing window to the queue."""
+        if self.coalescer is not None:
+            self.coalescer.flush()
+
+    def _post(self, message: Dict[str, Any]) -> bool:
         payload: str = "payload=" + json.dumps(message)
+        # errors propagate to the future and are logged by the queue
         try:
-            response: requests.Response = requests.post(self.income_wh_url, payload)
+            with metrics.OUTBOUND_SECONDS.time(self.queue.name):
+                response: requests.Response = self.http.post(
+                    self.income_wh_url, payload
+                )
             response.raise_for_status()  # Raise an exception if the response contains an HTTP error
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error sending message to Synology Chat: {e}")
+        except requests.exceptions.RequestException:
+            metrics.OUTBOUND_ERRORS.inc(self.queue.name)
+            raise
 
-        logging.debug(f"Sent message:{payload} to user_id:{user_id}")
+        logging.debug(f"Sent message:{payload} to user_ids:{message.get('user_ids')}")
+        return True
 
 
 class WebhookGetService:
-    def __init__(self, chat_server: str, token: str) -> None:
+    def __init__(
+        self,
+        chat_server: str,
+        token: str,
+        http: Optional[session.HttpSession] = None,
+    ) -> None:
         self.wh_token: str = token
         self.chat_server: str = chat_server
+        self.http: session.HttpSession = http if http else session.HttpSession()
 
-    def check_aval_users(self):
+    def check_aval_users(self) -> List[Dict[str, Any]]:
+        """Fetch the raw user list, raising on request errors."""
         check_url: str = f"{self.chat_server}/webapi/entry.cgi?api=SYNO.Chat.External&method=user_list&version=2"
         token: str = "token=" + self.wh_token
         try:
-            response: requests.Response = requests.get(
+            response: requests.Response = self.http.get(
                 check_url,
                 token,
             )
             # response = requests.post(INCOMING_WEBHOOK_URL, json=payload)
             response.raise_for_status()  # Raise an exception if the response contains an HTTP error
         except requests.exceptions.RequestException as e:
-            logging.error(f"Error sending message to Synology Chat: {e}")
-            return "Error sending message to Synology Chat", 500
+            logging.error(f"Error fetching user list from Synology Chat: {e}")
+            raise
 
         data = response.json()
         logging.debug(f"aval users json data:{data}")
@@ -59,7 +172,7 @@ class WebhookGetService:
 
         token: str = "token=" + self.wh_token
         try:
-            response: requests.Response = requests.get(
+            response: requests.Response = self.http.get(
                 check_url,
                 token,
             )
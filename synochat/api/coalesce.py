@@ -0,0 +1,197 @@
+"""Per-recipient merging of outbound posts sent in quick succession"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Set, Tuple
+
+import metrics
+
+# synology cuts longer messages
+MAX_TEXT = 1500
+SEPARATOR = "\n"
+
+Key = Tuple[int, ...]
+
+
+class _Group:
+    __slots__ = ("texts", "size", "file_url", "futures")
+
+    def __init__(self) -> None:
+        self.texts: List[str] = []
+        self.size: int = 0
+        self.file_url: str = ""
+        self.futures: List[Future] = []
+
+
+class Coalescer:
+    """Hold posts to the same recipients for `window` seconds and merge them
+
+    Messages to the same `user_ids` arriving within `window` seconds of the
+    first one are joined with newlines into one post, in arrival order,
+    while the merged text stays within `max_chars`. A message with a
+    file_url closes its group, since a post carries one file. Every message
+    keeps its own future, resolved with the result of the merged post.
+
+    Closed groups are handed to `send` outside the coalescer's lock, since
+    `send` may block on a full outbound queue. One thread at a time sends a
+    recipients' groups, so their posts reach the queue in order. One daemon
+    thread closes groups whose window has passed; it calls `send` with
+    block=False, so a full shard rejects its groups instead of holding up
+    the windows of every other recipient.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any], bool], Future],
+        window: float = 0.2,
+        max_chars: int = MAX_TEXT,
+        name: str = "outbound",
+    ) -> None:
+        self.send: Callable[[Dict[str, Any], bool], Future] = send
+        self.window: float = window
+        self.max_chars: int = max_chars
+        self.name: str = name
+        self.merged: int = 0
+        self._groups: Dict[Key, _Group] = {}
+        # closed groups waiting for `send`, and keys some thread is sending
+        self._ready: Dict[Key, Deque[_Group]] = {}
+        self._sending: Set[Key] = set()
+        # groups by deadline, the window is fixed so arrival order is enough
+        self._deadlines: Deque[Tuple[float, Key, _Group]] = collections.deque()
+        self._cond = threading.Condition()
+        self._pid: int = -1
+
+    def _ensure_started(self) -> None:
+        # threads do not survive fork, so restart the flusher in a new process
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(
+                target=self._run, name=f"{self.name}-coalesce", daemon=True
+            ).start()
+            self._pid = os.getpid()
+
+    def add(self, message: Dict[str, Any]) -> Future:
+        """Queue `message` for merging, returns the future of its post."""
+        self._ensure_started()
+        key: Key = tuple(message.get("user_ids", ()))
+        text: str = message.get("text", "")
+        future: Future = Future()
+        closed: bool = False
+        with self._cond:
+            group: _Group | None = self._groups.get(key)
+            if group is not None and (
+                group.size + len(SEPARATOR) + len(text) > self.max_chars
+            ):
+                self._close(key)
+                closed = True
+                group = None
+            if group is None:
+                group = self._groups[key] = _Group()
+                self._deadlines.append((time.monotonic() + self.window, key, group))
+                self._cond.notify()
+            else:
+                group.size += len(SEPARATOR)
+            group.texts.append(text)
+            group.size += len(text)
+            group.futures.append(future)
+            if message.get("file_url") or group.size >= self.max_chars:
+                group.file_url = message.get("file_url", "")
+                self._close(key)
+                closed = True
+        if closed:
+            self._drain(key)
+        return future
+
+    def _close(self, key: Key) -> None:
+        # called with the lock held, queues the group for `_drain`
+        group: _Group = self._groups.pop(key)
+        self._ready.setdefault(key, collections.deque()).append(group)
+        if len(group.futures) > 1:
+            self.merged += len(group.futures) - 1
+
+    def _drain(self, key: Key, block: bool = True) -> None:
+        # called without the lock, sends the closed groups of `key` in order
+        with self._cond:
+            if key in self._sending:
+                # the thread sending them picks ours up as well
+                return
+            self._sending.add(key)
+        while True:
+            with self._cond:
+                ready: Deque[_Group] | None = self._ready.get(key)
+                if not ready:
+                    self._ready.pop(key, None)
+                    self._sending.discard(key)
+                    self._cond.notify_all()
+                    return
+                group: _Group = ready.popleft()
+            self._send(key, group, block)
+
+    def _send(self, key: Key, group: _Group, block: bool) -> None:
+        message: Dict[str, Any] = {"text": SEPARATOR.join(group.texts)}
+        if key:
+            message["user_ids"] = list(key)
+        if group.file_url:
+            message["file_url"] = group.file_url
+        if len(group.futures) > 1:
+            metrics.OUTBOUND_COALESCED.inc(self.name, amount=len(group.futures) - 1)
+        try:
+            sent: Future = self.send(message, block)
+        except Exception as e:
+            logging.error(f"Coalescer:{self.name} failed to queue a post: {e}")
+            for future in group.futures:
+                future.set_exception(e)
+            return
+        futures: List[Future] = group.futures
+
+        def resolve(done: Future) -> None:
+            error = done.exception()
+            for future in futures:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(done.result())
+
+        sent.add_done_callback(resolve)
+
+    def flush(self) -> None:
+        """Send every pending group now."""
+        with self._cond:
+            keys: List[Key] = list(self._groups)
+            for key in keys:
+                self._close(key)
+            self._deadlines.clear()
+        for key in keys:
+            self._drain(key)
+        # groups other threads are still sending
+        with self._cond:
+            while self._ready:
+                self._cond.wait()
+
+    def pending(self) -> int:
+        return len(self._groups)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._deadlines:
+                    self._cond.wait()
+                deadline, key, group = self._deadlines[0]
+                delay: float = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._deadlines.popleft()
+                # a group closed early by size or file is gone already
+                if self._groups.get(key) is not group:
+                    continue
+                self._close(key)
+            # never wait on a full shard here, the queue counts the reject
+            self._drain(key, block=False)
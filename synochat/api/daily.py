@@ -1,6 +1,13 @@
+import datetime
+import json
+import logging
+import os
 import pprint
+import random
+import threading
 import time
-from typing import Dict
+from concurrent.futures import Future
+from typing import Dict, Optional
 
 import requests
 
@@ -41,11 +48,74 @@ class Constant:
     }
     """
 
-    # http call retries
-    HTTP_CALL_RETRIES = 3
+    # seconds to wait for leetcode before giving up on a request
+    HTTP_TIMEOUT = 10
 
-    # default sleep duration
-    DEFAULT_SLEEP = 3600
+    # consecutive failures that open the circuit, and seconds it stays open
+    BREAKER_FAILURES = 3
+    BREAKER_RESET = 300
+
+    # background retry backoff, doubling from base up to cap seconds
+    RETRY_BASE = 10
+    RETRY_CAP = 1800
+
+    # seconds before asking again when leetcode still serves yesterday
+    ROLLOVER_RETRY = 60
+
+    # days of challenges kept by the cache
+    CACHE_DAYS = 7
+
+
+class LeetcodeError(Exception):
+    """Daily challenge could not be fetched from leetcode."""
+
+
+class CircuitBreaker:
+    """Fail fast while a remote service keeps failing
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. Then one trial call is let
+    through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: str = self.CLOSED
+        self.failures: int = 0
+        self._opened_at: float = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            tripped: bool = self.failures >= self.failure_threshold
+            if self.state == self.HALF_OPEN or tripped:
+                if self.state != self.OPEN:
+                    logging.warning("Leetcode circuit opened")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
 
 
 class RequestHandler:
@@ -53,22 +123,204 @@ class RequestHandler:
 
     url = Constant.LEETCODE_API_ENDPOINT
     query = Constant.DAILY_CODING_CHALLENGE_QUERY
-    max_retries = Constant.HTTP_CALL_RETRIES
+    timeout = Constant.HTTP_TIMEOUT
+    breaker = CircuitBreaker(Constant.BREAKER_FAILURES, Constant.BREAKER_RESET)
 
     @classmethod
-    def get_challenge_info(cls) -> Dict:
-        """Get daily challenge info from leetcode API."""
-        for iteration in range(cls.max_retries):
-            try:
-                response = requests.post(cls.url, json={"query": cls.query})
-                return (
-                    response.json()
-                    .get("data")
-                    .get("activeDailyCodingChallengeQuestion")
-                )
-            except Exception:
-                time.sleep(((iteration + 1) * 10) * 60)
-        raise SystemExit("Could not connect to the leetcode server.")
+    def get_challenge_info(cls, url: Optional[str] = None) -> Dict:
+        """Get daily challenge info from leetcode API in a single attempt.
+
+        Raises:
+            LeetcodeError: request failed, or refused while the circuit is open
+        """
+        if not cls.breaker.allow():
+            raise LeetcodeError("Leetcode circuit is open, not calling the server")
+        try:
+            response = requests.post(
+                url or cls.url, json={"query": cls.query}, timeout=cls.timeout
+            )
+            response.raise_for_status()
+            info = response.json()["data"]["activeDailyCodingChallengeQuestion"]
+            if not info:
+                raise ValueError("empty daily challenge")
+        except (
+            requests.exceptions.RequestException,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as e:
+            cls.breaker.record_failure()
+            raise LeetcodeError(f"Could not get the daily challenge: {e}") from e
+        cls.breaker.record_success()
+        return info
+
+
+class ChallengeCache:
+    """Daily challenge info cached by challenge date
+
+    The daily challenge changes once a day at 00:00 UTC, so every `get` of
+    the same day is served from memory. Concurrent misses share a single
+    request to leetcode, and fetched days are written to `path` (when given)
+    so a restart does not need the network. Schedule `prewarm` right after
+    the rollover to fetch the new challenge before anyone asks.
+
+    A failed fetch never blocks the caller: `get` falls back to the latest
+    cached day (raising LeetcodeError only when there is none) and retries in
+    the background with jittered exponential backoff until today's
+    challenge arrives.
+
+    Every fetched challenge is also parsed into `history`, which keeps past
+    days beyond the cache window.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        url: Optional[str] = None,
+        history: Optional[lc.ChallengeHistory] = None,
+    ) -> None:
+        self.path: Optional[str] = path
+        self.url: str = url or RequestHandler.url
+        self.history: lc.ChallengeHistory = (
+            history if history is not None else lc.ChallengeHistory()
+        )
+        self._challenges: Dict[str, Dict] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._retry_after: Dict[str, float] = {}
+        self._retrying: Optional[str] = None
+        self._lock = threading.Lock()
+        self._load()
+        for info in self._challenges.values():
+            self.history.add(RequestParser.parse(info))
+
+    @staticmethod
+    def today() -> str:
+        return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as cache_file:
+                self._challenges = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable challenge cache {self.path}: {e}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        tmp_path: str = self.path + ".tmp"
+        # best effort, a full or read-only disk must not fail a fetch
+        try:
+            with open(tmp_path, "w") as cache_file:
+                json.dump(self._challenges, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Could not write challenge cache {self.path}: {e}")
+
+    def _latest(self) -> Optional[Dict]:
+        if not self._challenges:
+            return None
+        return self._challenges[max(self._challenges)]
+
+    def _put(self, key: str, info: Dict) -> None:
+        with self._lock:
+            date: str = info.get("date") or key
+            self._challenges[date] = info
+            for old in sorted(self._challenges)[: -Constant.CACHE_DAYS]:
+                del self._challenges[old]
+            if date != key:
+                # leetcode has not rolled over yet
+                self._retry_after[key] = time.monotonic() + Constant.ROLLOVER_RETRY
+            else:
+                self._retry_after.pop(key, None)
+            self._save()
+        self.history.add(RequestParser.parse(info))
+
+    def is_today(self, info: Dict) -> bool:
+        return info.get("date") == self.today()
+
+    def get(self) -> Dict:
+        """Return today's challenge info, fetching it at most once.
+
+        Raises:
+            LeetcodeError: leetcode is unreachable and nothing is cached
+        """
+        key: str = self.today()
+        info: Optional[Dict] = self._challenges.get(key)
+        if info is not None:
+            return info
+        with self._lock:
+            info = self._challenges.get(key)
+            if info is None and time.monotonic() < self._retry_after.get(key, 0):
+                info = self._latest()
+            if info is not None:
+                return info
+            future: Optional[Future] = self._inflight.get(key)
+            leader: bool = future is None
+            if future is None:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            info = self._fetch(key)
+        except LeetcodeError as e:
+            logging.warning(f"{e}, serving the last known challenge")
+            self._schedule_retry(key, 0)
+            info = self._latest()
+            if info is None:
+                future.set_exception(e)
+                raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        future.set_result(info)
+        return info
+
+    def _fetch(self, key: str) -> Dict:
+        info: Dict = RequestHandler.get_challenge_info(self.url)
+        self._put(key, info)
+        return info
+
+    def _schedule_retry(self, key: str, attempt: int) -> None:
+        with self._lock:
+            if attempt == 0 and self._retrying == key:
+                return
+            self._retrying = key
+        delay: float = min(Constant.RETRY_CAP, Constant.RETRY_BASE * 2**attempt)
+        delay *= random.uniform(0.5, 1.5)
+        logging.info(f"Retrying leetcode in {delay:.0f}s (attempt {attempt + 1})")
+        timer = threading.Timer(delay, self._retry, args=(key, attempt + 1))
+        timer.daemon = True
+        timer.start()
+
+    def _retry(self, key: str, attempt: int) -> None:
+        rescheduled: bool = False
+        try:
+            if key != self.today() or key in self._challenges:
+                return
+            self._fetch(key)
+        except LeetcodeError as e:
+            logging.warning(str(e))
+            self._schedule_retry(key, attempt)
+            rescheduled = True
+        finally:
+            # anything else must not leave retries switched off for good
+            if not rescheduled:
+                with self._lock:
+                    self._retrying = None
+
+    def prewarm(self) -> None:
+        logging.info("Prewarming leetcode daily challenge")
+        try:
+            self.get()
+        except LeetcodeError as e:
+            logging.warning(f"Prewarm failed, retrying in background: {e}")
 
 
 class RequestParser:
@@ -83,15 +335,18 @@ class RequestParser:
     def _parse_challenge_info(cls, challenge_info) -> lc.Challenge:
         """Parse and update challenge model."""
         question = challenge_info.get("question")
-        challenge = lc.Challenge()
-        challenge.title = question.get("title")
-        challenge.ac_rate = question.get("acRate")
-        challenge.difficulty = question.get("difficulty")
-        challenge.question_id = question.get("frontendQuestionId")
-        challenge.date = challenge_info.get("date")
-        challenge.title_slug = question.get("titleSlug")
-        challenge.raw_tags = question.get("topicTags")
-        return challenge
+        return lc.Challenge(
+            title=question.get("title"),
+            ac_rate=question.get("acRate"),
+            difficulty=question.get("difficulty"),
+            question_id=question.get("frontendQuestionId"),
+            date=challenge_info.get("date"),
+            title_slug=question.get("titleSlug"),
+            raw_tags=tuple(
+                lc.Tag(name=tag.get("name"), slug=tag.get("slug"))
+                for tag in question.get("topicTags") or ()
+            ),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+"""Bounded outbound message queue drained by a pool of sender threads"""
+
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# (job, future) pair, None is the stop sentinel
+_Item = Optional[Tuple[Callable[[], Any], Future]]
+
+
+class RateMeter:
+    """Count events in one-second buckets over a sliding window."""
+
+    def __init__(self, window: int = 60) -> None:
+        self.window: int = window
+        self._buckets: Deque[List[int]] = collections.deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: int) -> None:
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def add(self, count: int = 1) -> None:
+        now = int(time.monotonic())
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == now:
+                self._buckets[-1][1] += count
+            else:
+                self._buckets.append([now, count])
+            self._trim(now)
+
+    def rate(self) -> float:
+        """Average events per second over the window."""
+        now = int(time.monotonic())
+        with self._lock:
+            self._trim(now)
+            total = sum(count for _, count in self._buckets)
+        return total / self.window
+
+
+class OutboundQueue:
+    """Asynchronous sender for outbound webhook posts
+
+    Jobs are sharded over `workers` threads by a routing key (the recipient
+    user id), so messages to the same user keep their order while different
+    users are sent in parallel. Each shard holds at most
+    `maxsize // workers` pending jobs; a full shard blocks the caller for up
+    to `put_timeout` seconds before the job is rejected.
+
+    With `workers=0` jobs run inline in the caller, which is handy for
+    scripts and debugging.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        maxsize: int = 1000,
+        put_timeout: float = 5.0,
+        name: str = "outbound",
+    ) -> None:
+        self.workers: int = workers
+        self.maxsize: int = maxsize
+        self.put_timeout: float = put_timeout
+        self.name: str = name
+        self._shards: List[queue.Queue[_Item]] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._pid: int = -1
+        self._stat_lock = threading.Lock()
+        self.sent: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.drain_meter = RateMeter()
+
+    def _ensure_started(self) -> None:
+        # threads do not survive fork, so restart them in a new process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            shard_size: int = max(1, self.maxsize // max(1, self.workers))
+            self._shards = [
+                queue.Queue(maxsize=shard_size) for _ in range(self.workers)
+            ]
+            self._threads = []
+            for idx, shard in enumerate(self._shards):
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(shard,),
+                    name=f"{self.name}-{idx}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _execute(self, job: Callable[[], Any], future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = job()
+        except Exception as e:
+            with self._stat_lock:
+                self.failed += 1
+            logging.error(f"Outbound queue:{self.name} job failed: {e}")
+            future.set_exception(e)
+            return
+        with self._stat_lock:
+            self.sent += 1
+        self.drain_meter.add()
+        future.set_result(result)
+
+    def _run(self, shard: "queue.Queue[_Item]") -> None:
+        while True:
+            item = shard.get()
+            try:
+                if item is None:
+                    return
+                self._execute(*item)
+            finally:
+                shard.task_done()
+
+    def submit(
+        self, job: Callable[[], Any], key: int = 0, block: bool = True
+    ) -> Future:
+        """Queue a job and return its future without waiting for it to run.
+
+        Args:
+            job (Callable): zero-argument callable doing the actual send
+            key (int): routing key, jobs with the same key run in order
+            block (bool): wait up to put_timeout for room on a full shard,
+                otherwise reject the job at once
+
+        Returns:
+            Future: resolves to the job's return value
+        """
+        future: Future = Future()
+        if self.workers <= 0:
+            self._execute(job, future)
+            return future
+
+        self._ensure_started()
+        shard = self._shards[self.shard_of(key)]
+        try:
+            if block:
+                shard.put((job, future), timeout=self.put_timeout)
+            else:
+                shard.put_nowait((job, future))
+        except queue.Full:
+            with self._stat_lock:
+                self.rejected += 1
+            logging.error(
+                f"Outbound queue:{self.name} full, dropped message for key:{key}"
+            )
+            future.set_exception(queue.Full(f"outbound queue {self.name} is full"))
+        return future
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth and throughput for sizing the pool."""
+        return {
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "depth": self.depth(),
+            "shard_depth": [shard.qsize() for shard in self._shards],
+            "sent": self.sent,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "drain_rate": self.drain_meter.rate(),
+        }
+
+    def shard_of(self, key: int) -> int:
+        """Shard, and so sender thread, that jobs routed by `key` go to."""
+        return hash(key) % self.workers if self.workers > 0 else 0
+
+    def join(self) -> None:
+        """Block until every queued job has been sent."""
+        for shard in self._shards:
+            shard.join()
+
+    def stop(self) -> None:
+        """Drain pending jobs and stop the sender threads."""
+        if self._pid != os.getpid():
+            return
+        for shard in self._shards:
+            shard.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._pid = -1
@@ -0,0 +1,80 @@
+"""Shared keep-alive HTTP session for the Synology webhook services"""
+
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpSession:
+    """Thread-safe pooled HTTP session
+
+    One `requests.Session` is shared by every sender of a ChatService, so
+    consecutive posts reuse the same TCP/TLS connection instead of paying a
+    fresh handshake each time. Connections that sat idle longer than
+    `idle_timeout` are dropped before the next request, since the Synology
+    server will have closed them on its side by then.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        idle_timeout: float = 60.0,
+        timeout: float = 10.0,
+    ) -> None:
+        self.pool_size: int = pool_size
+        self.keep_alive: bool = keep_alive
+        self.idle_timeout: float = idle_timeout
+        self.timeout: float = timeout
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._last_used: float = 0.0
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            pool_block=False,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def _acquire(self) -> requests.Session:
+        with self._lock:
+            now: float = time.monotonic()
+            if (
+                self._session is not None
+                and self.idle_timeout > 0
+                and now - self._last_used > self.idle_timeout
+            ):
+                logging.debug("Evicting idle HTTP connections")
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+            self._last_used = now
+            return self._session
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self._acquire().request(method, url, **kwargs)
+
+    def post(self, url: str, data: Any = None, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, data=data, **kwargs)
+
+    def get(self, url: str, params: Any = None, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, params=params, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
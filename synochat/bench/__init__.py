@@ -0,0 +1 @@
+"""Benchmarks for the bot, run from the synochat directory with `python -m bench.<name>`"""
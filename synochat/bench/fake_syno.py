@@ -0,0 +1,231 @@
+"""Local stand-in for the Synology Chat external api
+
+Implements the `SYNO.Chat.External` methods the bot calls (`incoming`,
+`chatbot`, `user_list` and `channel_list`) on `/webapi/entry.cgi`, with
+configurable latency, error rate and per-token rate limit. Every accepted
+post is kept in a bounded log, optionally appended to an NDJSON file, and
+can be read back from `/_messages`; counters are on `/_stats`.
+
+Point the bot at it by setting `SERVER_URL` and the `incoming_url` of
+`BOT_CONF`/`CHANNEL_SERVICE_CONF` in service_conf.py to this server, e.g.
+`http://127.0.0.1:5080/webapi/entry.cgi?api=SYNO.Chat.External&method=chatbot&version=2&token=x`
+
+Failures mimic Synology's json error body but use HTTP 500 (injected error)
+and 429 (rate limited), so `raise_for_status` sees them.
+
+Usage:
+    python -m bench.fake_syno --port 5080 --latency-ms 30 --error-rate 0.01
+"""
+
+import argparse
+import collections
+import dataclasses
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from typing import Any, Deque, Dict, List, Optional
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import BaseWSGIServer, make_server
+
+TIMEZONES = ("Asia/Taipei", "Europe/Berlin", "America/New_York", "UTC")
+
+# synology's code for posting too frequently
+RATE_LIMITED = 411
+
+
+@dataclasses.dataclass
+class FakeConf:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    # posts per second per token, 0 disables the limit
+    rate_limit: float = 0.0
+    users: int = 2000
+    channels: int = 5
+    keep_messages: int = 10000
+    log_path: Optional[str] = None
+
+
+class _TokenBucket:
+    def __init__(self, rate: float) -> None:
+        self.rate: float = rate
+        self.tokens: float = rate
+        self.stamp: float = time.monotonic()
+
+    def take(self) -> bool:
+        now: float = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeSynoServer(Flask):
+    def __init__(self, conf: FakeConf, seed: int = 1) -> None:
+        super().__init__(import_name=__name__, static_folder=None)
+        self.conf: FakeConf = conf
+        self.rng = random.Random(seed)
+        self.messages: Deque[Dict[str, Any]] = collections.deque(
+            maxlen=conf.keep_messages
+        )
+        self.stats: Dict[str, int] = collections.Counter()
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._users: List[Dict[str, Any]] = [
+            _user(user_id, self.rng) for user_id in range(1, conf.users + 1)
+        ]
+        self._channels: List[Dict[str, Any]] = [
+            {"channel_id": idx, "name": f"channel{idx}", "type": "public"}
+            for idx in range(1, conf.channels + 1)
+        ]
+        self.add_url_rule(
+            "/webapi/entry.cgi", view_func=self.entry, methods=["GET", "POST"]
+        )
+        self.add_url_rule("/_messages", view_func=self.recorded)
+        self.add_url_rule("/_stats", view_func=lambda: jsonify(self.stats))
+
+    def entry(self) -> Response:
+        method: str = request.args.get("method", "")
+        token: str = request.args.get("token", "").strip('"')
+        self._delay()
+        with self._lock:
+            self.stats[f"{method}_calls"] += 1
+            if self.rng.random() < self.conf.error_rate:
+                self.stats[f"{method}_errors"] += 1
+                return _error(117, 500)
+            if method in ("incoming", "chatbot") and not self._allow(token):
+                self.stats[f"{method}_limited"] += 1
+                return _error(RATE_LIMITED, 429)
+
+        if method == "user_list":
+            return jsonify({"success": True, "data": {"users": self._users}})
+        if method == "channel_list":
+            return jsonify({"success": True, "data": {"channels": self._channels}})
+        if method in ("incoming", "chatbot"):
+            payload: Optional[Dict[str, Any]] = _payload(request.get_data(as_text=True))
+            if payload is None or "text" not in payload:
+                return _error(120, 400)
+            self._record(method, token, payload)
+            return jsonify({"success": True})
+        return _error(103, 400)
+
+    def recorded(self) -> Response:
+        limit: int = int(request.args.get("limit", 100))
+        with self._lock:
+            messages: List[Dict[str, Any]] = list(self.messages)[-limit:]
+        return jsonify(messages)
+
+    def _delay(self) -> None:
+        delay_ms: float = self.conf.latency_ms
+        if self.conf.jitter_ms:
+            delay_ms += self.rng.uniform(-self.conf.jitter_ms, self.conf.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _allow(self, token: str) -> bool:
+        if self.conf.rate_limit <= 0:
+            return True
+        bucket: Optional[_TokenBucket] = self._buckets.get(token)
+        if bucket is None:
+            bucket = self._buckets[token] = _TokenBucket(self.conf.rate_limit)
+        return bucket.take()
+
+    def _record(self, method: str, token: str, payload: Dict[str, Any]) -> None:
+        entry: Dict[str, Any] = {
+            "time": time.time(),
+            "method": method,
+            "token": token,
+            "user_ids": payload.get("user_ids", []),
+            "text": payload["text"],
+            "file_url": payload.get("file_url", ""),
+        }
+        with self._lock:
+            self.messages.append(entry)
+            self.stats["messages"] += 1
+            self.stats["recipients"] += max(1, len(entry["user_ids"]))
+            if self.conf.log_path:
+                with open(self.conf.log_path, "a") as log_file:
+                    log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _user(user_id: int, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "avatar_version": 0,
+        "deleted": False,
+        "dsm_uid": 1000 + user_id,
+        "first_time_login": False,
+        "human_type": "dsm",
+        "is_disabled": False,
+        "nickname": f"User {user_id}",
+        "status": "online",
+        "type": "human",
+        "user_id": user_id,
+        "username": f"user{user_id}",
+        "user_props": {
+            "avatar_color": "#4cbf73",
+            "description": "",
+            "email": f"user{user_id}@example.com",
+            "key_pair": {"public_key": ""},
+            "timezone": "",
+            "timezoneUTC": rng.choice(TIMEZONES),
+        },
+    }
+
+
+def _payload(body: str) -> Optional[Dict[str, Any]]:
+    # the bot sends a raw `payload=<json>`, browsers and curl url-encode it
+    if not body.startswith("payload="):
+        return None
+    raw: str = body[len("payload=") :]
+    for candidate in (raw, urllib.parse.unquote_plus(raw)):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+def _error(code: int, status: int) -> Response:
+    response: Response = jsonify({"success": False, "error": {"code": code}})
+    response.status_code = status
+    return response
+
+
+def serve_in_thread(app: FakeSynoServer, port: int = 0) -> BaseWSGIServer:
+    """Start `app` on a daemon thread, returns the server (see server_port)."""
+    wsgi_server: BaseWSGIServer = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=wsgi_server.serve_forever, daemon=True).start()
+    return wsgi_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5080)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="posts/s/token")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--log", dest="log_path", help="append posts to NDJSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    conf = FakeConf(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        users=args.users,
+        log_path=args.log_path,
+    )
+    FakeSynoServer(conf).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Write throughput of SubStore under concurrent `note` traffic
+
+Every thread plays a set of subscribers appending timestamped notes, the same
+write `Agnomeing.note` issues, while a flusher commits on the reminder
+service's interval. Prints one JSON line per batch size.
+
+Usage:
+    python -m bench.store_writes --threads 8 --notes 2000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+from model import store, subscribe
+
+
+def run(threads: int, notes: int, batch_size: int, users: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sub_store = store.SubStore(
+            os.path.join(tmp_dir, "bench.db"), batch_size=batch_size
+        )
+        now = datetime.datetime.now()
+        sub_store.upsert_subs(
+            subscribe.SubInfo(
+                wait_for_reply=False,
+                wait_time=now,
+                u_id=u_id,
+                u_name=f"user{u_id}",
+                sub_time=now,
+                on_time=now,
+                idx_hour=0,
+            )
+            for u_id in range(users)
+        )
+        sub_store.flush()
+
+        stop = threading.Event()
+
+        def flusher() -> None:
+            while not stop.wait(sub_store.flush_interval):
+                sub_store.flush()
+
+        def writer(worker: int) -> None:
+            for i in range(notes):
+                u_id = (worker * notes + i) % users
+                sub_store.append_note(u_id, i % 8, f"{now:%H:%M} note {i}")
+
+        flush_thread = threading.Thread(target=flusher, daemon=True)
+        flush_thread.start()
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        sub_store.flush()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        flush_thread.join()
+
+        load_start = time.perf_counter()
+        sub_store.load(8)
+        load_time = time.perf_counter() - load_start
+        sub_store.close()
+
+    total = threads * notes
+    return {
+        "threads": threads,
+        "batch_size": batch_size,
+        "writes": total,
+        "seconds": round(elapsed, 4),
+        "writes_per_sec": round(total / elapsed, 1),
+        "load_seconds": round(load_time, 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--notes", type=int, default=2000, help="notes per thread")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 16, 64, 256]
+    )
+    args = parser.parse_args()
+    for batch_size in args.batch_sizes:
+        print(json.dumps(run(args.threads, args.notes, batch_size, args.users)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Per-subscriber memory of dict+SubInfo storage versus SubTable
+
+Notes are left out of both layouts since the same NoteBuffer objects are
+held either way. Prints one JSON line.
+
+Usage:
+    python -m bench.sub_memory --users 100000
+"""
+
+import argparse
+import datetime
+import json
+import tracemalloc
+from typing import Any, Callable, Dict, Set
+
+from model import subscribe
+
+
+def _info(u_id: int, now: datetime.datetime) -> subscribe.SubInfo:
+    return subscribe.SubInfo(
+        wait_for_reply=bool(u_id & 1),
+        wait_time=now + datetime.timedelta(seconds=u_id),
+        u_id=u_id,
+        u_name=f"user{u_id}",
+        sub_time=now + datetime.timedelta(seconds=u_id),
+        on_time=now + datetime.timedelta(seconds=u_id),
+        idx_hour=u_id % 8,
+    )
+
+
+def build_dicts(users: int) -> Any:
+    now = datetime.datetime.now()
+    sub_list: Dict[int, subscribe.SubInfo] = {}
+    sub_id: Set[int] = set()
+    for u_id in range(users):
+        sub_list[u_id] = _info(u_id, now)
+        sub_id.add(u_id)
+    return sub_list, sub_id
+
+
+def build_table(users: int) -> Any:
+    now = datetime.datetime.now()
+    table = subscribe.SubTable()
+    notes = subscribe.NoteBuffer(0)
+    for u_id in range(users):
+        table.add(_info(u_id, now), notes)
+    return table
+
+
+def measure(build: Callable[[int], Any], users: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(users)  # NOQA: F841
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / users
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            {
+                "users": args.users,
+                "dict_bytes_per_user": round(measure(build_dicts, args.users), 1),
+                "table_bytes_per_user": round(measure(build_table, args.users), 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
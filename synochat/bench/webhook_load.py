@@ -0,0 +1,286 @@
+"""Latency of ServiceServer.webhook under synthetic Synology traffic
+
+Plays outgoing-webhook form posts from many synthetic users with a weighted
+mix of commands, either in-process through Flask's test client or over HTTP
+against a running server (`--url`). Requests are issued open-loop at
+`--rate` per second (0 means as fast as the threads go). Prints one JSON
+document with throughput and p50/p95/p99 latency per command.
+
+In-process runs use a throwaway store. Replies are posted to
+`--incoming-url`, the user list is fetched from `--server-url` and `lc` asks
+`--leetcode-url`, all a closed local port by default, so nothing leaves the
+machine. With `--fake-syno` replies and user list calls go to a
+bench.fake_syno server started in-process instead, and its counters are
+added to the report, covering the outbound path end to end.
+
+Usage:
+    python -m bench.webhook_load --users 2000 --requests 20000 --threads 8
+    python -m bench.webhook_load --url http://127.0.0.1:5000/webhook --rate 200
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from bench import fake_syno
+from service_conf import BOT_CONF
+
+DEFAULT_MIX = "note=40,log=15,amend=10,lc=10,unknown=15,sub=5,unsub=5"
+
+WORDS = (
+    "review deploy fix bug write test meeting email build release "
+    "refactor docs verify package sync standup design"
+).split()
+
+
+def _text(name: str, rng: random.Random) -> str:
+    if name == "note":
+        return "note " + " ".join(rng.choices(WORDS, k=rng.randint(2, 12)))
+    if name == "amend":
+        words = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)))
+        return f"amend {rng.randint(1, 8)} {words}"
+    if name == "sub":
+        return "sub reminder"
+    if name == "unsub":
+        return "unsub reminder"
+    if name == "unknown":
+        return " ".join(rng.choices(WORDS, k=3))
+    return name
+
+
+def parse_mix(mix: str) -> Tuple[List[str], List[int]]:
+    names: List[str] = []
+    weights: List[int] = []
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        names.append(name.strip())
+        weights.append(int(weight))
+    return names, weights
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = round(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+
+def summarize(latencies: List[float], errors: int) -> Dict[str, Any]:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def in_process_target(
+    store_dir: str, server_url: str, incoming_url: str, leetcode_url: str
+) -> Tuple[Callable[[Dict[str, str]], int], Any]:
+    # imported here so HTTP runs do not need the server's dependencies
+    import server
+
+    app = server.ServiceServer(
+        "bench",
+        "127.0.0.1",
+        0,
+        {**BOT_CONF, "server_url": server_url, "incoming_url": incoming_url},
+        store_path=os.path.join(store_dir, "bench.db"),
+    )
+    app.agnomer.challenge_cache.url = leetcode_url
+    local = threading.local()
+
+    def post(form: Dict[str, str]) -> int:
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        return local.client.post("/webhook", data=form).status_code
+
+    return post, app
+
+
+def http_target(url: str) -> Callable[[Dict[str, str]], int]:
+    local = threading.local()
+
+    def post(form: Dict[str, str]) -> int:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session.post(url, data=form, timeout=30).status_code
+
+    return post
+
+
+def run(
+    post: Callable[[Dict[str, str]], int],
+    users: int,
+    total: int,
+    threads: int,
+    rate: float,
+    mix: str,
+    seed: int,
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    names, weights = parse_mix(mix)
+    plan: List[Tuple[str, int, str]] = []
+    for _ in range(total):
+        name = rng.choices(names, weights)[0]
+        plan.append((name, rng.randrange(users), _text(name, rng)))
+
+    def form(idx: int, user_id: int, text: str) -> Dict[str, str]:
+        return {
+            "token": BOT_CONF["token"],
+            "user_id": str(user_id + 1),
+            "username": f"user{user_id + 1}",
+            "post_id": str(idx + 1),
+            "thread_id": "0",
+            "timestamp": str(int(time.time() * 1000)),
+            "text": text,
+        }
+
+    # subscribe everyone first so note/log/amend take their real path
+    for user_id in range(users):
+        post(form(-1, user_id, "sub reminder"))
+
+    results: Dict[str, Tuple[List[float], List[int]]] = {
+        name: ([], [0]) for name in names
+    }
+    lock = threading.Lock()
+    cursor = iter(range(total))
+    start = time.perf_counter()
+
+    def worker() -> None:
+        while True:
+            with lock:
+                idx = next(cursor, None)
+            if idx is None:
+                return
+            if rate > 0:
+                delay = start + idx / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            name, user_id, text = plan[idx]
+            sent = time.perf_counter()
+            try:
+                ok = post(form(idx, user_id, text)) == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            latency = time.perf_counter() - sent
+            with lock:
+                results[name][0].append(latency)
+                if not ok:
+                    results[name][1][0] += 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [value for latencies, _ in results.values() for value in latencies]
+    all_errors = sum(errors[0] for _, errors in results.values())
+    return {
+        "users": users,
+        "requests": total,
+        "threads": threads,
+        "target_rate": rate,
+        "seconds": round(elapsed, 4),
+        "throughput": round(total / elapsed, 1),
+        "all": summarize(all_latencies, all_errors),
+        "commands": {
+            name: summarize(latencies, errors[0])
+            for name, (latencies, errors) in results.items()
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="requests per second")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command=weight,...")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="webhook url of a running server")
+    parser.add_argument(
+        "--server-url",
+        default="http://127.0.0.1:9",
+        help="synology server an in-process server loads its user list from",
+    )
+    parser.add_argument(
+        "--incoming-url",
+        default="http://127.0.0.1:9/webapi/entry.cgi",
+        help="where an in-process server posts its replies",
+    )
+    parser.add_argument(
+        "--leetcode-url",
+        default="http://127.0.0.1:9/graphql",
+        help="leetcode api used by an in-process server",
+    )
+    parser.add_argument(
+        "--fake-syno",
+        action="store_true",
+        help="post in-process replies to a local fake synology server",
+    )
+    parser.add_argument("--fake-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    fake: Optional[fake_syno.FakeSynoServer] = None
+    server_url: str = args.server_url
+    incoming_url: str = args.incoming_url
+    if args.fake_syno and not args.url:
+        fake = fake_syno.FakeSynoServer(
+            fake_syno.FakeConf(latency_ms=args.fake_latency_ms, users=args.users)
+        )
+        port = fake_syno.serve_in_thread(fake).server_port
+        server_url = f"http://127.0.0.1:{port}"
+        incoming_url = (
+            f"{server_url}/webapi/entry.cgi"
+            "?api=SYNO.Chat.External&method=chatbot&version=2&token=bench"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = None
+        if args.url:
+            post = http_target(args.url)
+        else:
+            post, app = in_process_target(
+                tmp_dir, server_url, incoming_url, args.leetcode_url
+            )
+        result = run(
+            post,
+            args.users,
+            args.requests,
+            args.threads,
+            args.rate,
+            args.mix,
+            args.seed,
+        )
+        if app is not None:
+            drain_start = time.perf_counter()
+            app.syno_api.web_post.flush()
+            app.syno_api.outbound.join()
+            result["outbound_drain_seconds"] = round(
+                time.perf_counter() - drain_start, 4
+            )
+            result["outbound"] = app.syno_api.outbound.stats()
+    result["mode"] = "http" if args.url else "in-process"
+    if fake is not None:
+        result["fake_syno"] = dict(fake.stats)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
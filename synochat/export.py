@@ -0,0 +1,234 @@
+"""Per-day export of subscribers' notes as gzip NDJSON, streamed back as NDJSON or CSV
+
+Rows roll over to a new day lazily (see Agnomeing._roll), so the export
+is taken row by row right before a roll discards the notes: `DayExporter.add`
+encodes one NDJSON line for the finished day and appends it, before the
+store deletes the notes, as one more gzip member (a multi-member gzip file
+reads as one stream). Nothing is buffered, so a worker exiting loses no day.
+
+Every process appends to files of its own, `<out_dir>/<date>.<node>.ndjson.gz`,
+so workers and hosts sharing `out_dir` never interleave writes. A day's
+export is all its files together, complete once all its rows rolled over,
+i.e. after the next work day's reminder window opened. Files older than
+`keep_days` are deleted. Only the newest day and the one before keep an open
+handle, the latter only while rows still roll into it; a late row of an
+older day reopens its file for append.
+
+Reading goes through a generator pipeline over a size snapshot of the files,
+so appends racing a download never show up half written:
+raw chunks -> gunzip -> lines -> records -> CSV rows -> gzip chunks.
+"""
+
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from model import lease, subscribe
+
+CHUNK_SIZE = 64 * 1024
+SUFFIX = ".ndjson.gz"
+# handles of days before the newest are closed once unused this long
+IDLE_SECONDS = 300.0
+
+CSV_FIELDS = ("date", "u_id", "u_name", "on_time", "idx_hour", "hour", "note")
+
+
+def record(date: datetime.date, subinfo: subscribe.SubRow) -> Dict[str, Any]:
+    """Export record of a row's day, taken before it rolls over."""
+    notes: subscribe.NoteBuffer = subinfo.notes
+    return {
+        "date": date.isoformat(),
+        "u_id": subinfo.u_id,
+        "u_name": subinfo.u_name,
+        "on_time": subinfo.on_time.isoformat(timespec="minutes"),
+        "idx_hour": subinfo.idx_hour,
+        "notes": [notes.render(hour) for hour in range(len(notes))],
+    }
+
+
+class DayExporter:
+    """Appending writer and streaming reader of the per-day export files"""
+
+    def __init__(
+        self, out_dir: str, keep_days: int = 90, node: str | None = None
+    ) -> None:
+        self.out_dir: str = out_dir
+        self.keep_days: int = keep_days
+        self.node: str = node or lease.default_node_id()
+        self._files: Dict[datetime.date, IO[bytes]] = {}
+        self._written: Dict[datetime.date, float] = {}
+        self._newest: datetime.date = datetime.date.min
+        self._lock = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def path(self, date: datetime.date) -> str:
+        """File this process appends the records of `date` to."""
+        return os.path.join(self.out_dir, f"{date.isoformat()}.{self.node}{SUFFIX}")
+
+    def paths(self, date: datetime.date) -> List[str]:
+        """Files of every process holding records of `date`."""
+        prefix: str = date.isoformat() + "."
+        return sorted(
+            os.path.join(self.out_dir, name)
+            for name in os.listdir(self.out_dir)
+            if name.startswith(prefix) and name.endswith(SUFFIX)
+        )
+
+    # writing
+    def add(self, entry: Dict[str, Any]) -> None:
+        """Append one record, written through before this returns."""
+        date = datetime.date.fromisoformat(entry["date"])
+        line: bytes = json.dumps(entry, ensure_ascii=False).encode() + b"\n"
+        member: bytes = zlib.compress(line, wbits=31)
+        with self._lock:
+            out: Optional[IO[bytes]] = self._files.get(date)
+            if out is None:
+                if date > self._newest:
+                    self._newest = date
+                    self._rotate(date)
+                out = self._files[date] = open(self.path(date), "ab")
+            out.write(member)
+            out.flush()
+            self._written[date] = time.monotonic()
+            self._close_idle()
+
+    def close(self) -> None:
+        with self._lock:
+            for out in self._files.values():
+                out.close()
+            self._files.clear()
+            self._written.clear()
+
+    def _close_idle(self) -> None:
+        # called with the lock held, see the module docstring
+        before: datetime.date = self._newest - datetime.timedelta(days=1)
+        idle: float = time.monotonic() - IDLE_SECONDS
+        for date in list(self._files):
+            if date < before or (date == before and self._written[date] < idle):
+                self._files.pop(date).close()
+                del self._written[date]
+
+    def _rotate(self, newest: datetime.date) -> None:
+        # called with the lock held, once per new day
+        cutoff: datetime.date = newest - datetime.timedelta(days=self.keep_days)
+        for name in os.listdir(self.out_dir):
+            if name.endswith(SUFFIX) and name < cutoff.isoformat():
+                try:
+                    os.remove(os.path.join(self.out_dir, name))
+                except FileNotFoundError:
+                    # removed by another process meanwhile
+                    continue
+                logging.info(f"Removed old export {name}")
+
+    # reading
+    def _snapshot(self, date: datetime.date) -> List[Tuple[str, int]]:
+        snapshot: List[Tuple[str, int]] = []
+        for path in self.paths(date):
+            try:
+                snapshot.append((path, os.path.getsize(path)))
+            except FileNotFoundError:
+                continue
+        return snapshot
+
+    def ndjson_chunks(self, date: datetime.date) -> Optional[Iterator[bytes]]:
+        """Gzip NDJSON of `date` as stored, None when nothing was exported."""
+        snapshot = self._snapshot(date)
+        if not snapshot:
+            return None
+        return _raw_chunks(snapshot)
+
+    def records(self, date: datetime.date) -> Optional[Iterator[Dict[str, Any]]]:
+        snapshot = self._snapshot(date)
+        if not snapshot:
+            return None
+        return (json.loads(line) for line in _lines(_gunzip(_raw_chunks(snapshot))))
+
+    def csv_chunks(self, date: datetime.date) -> Optional[Iterator[bytes]]:
+        """Gzip CSV of `date`, one row per non-empty hour of notes."""
+        records = self.records(date)
+        if records is None:
+            return None
+        return _gzip(_csv_lines(records))
+
+
+def _raw_chunks(snapshot: Iterable[Tuple[str, int]]) -> Iterator[bytes]:
+    # concatenated gzip files read as one multi-member stream
+    for path, size in snapshot:
+        try:
+            source = open(path, "rb")
+        except FileNotFoundError:
+            # rotated away meanwhile
+            continue
+        with source:
+            left: int = size
+            while left > 0:
+                chunk: bytes = source.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+
+
+def _gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # one decompressor per gzip member
+    decompressor = zlib.decompressobj(wbits=31)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(wbits=31)
+
+
+def _lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    rest: bytes = b""
+    for chunk in chunks:
+        rest += chunk
+        *lines, rest = rest.split(b"\n")
+        yield from lines
+    if rest:
+        yield rest
+
+
+def _csv_lines(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+    for entry in records:
+        notes: List[str] = entry["notes"]
+        for hour, note in enumerate(notes, start=1):
+            if not note:
+                continue
+            writer.writerow(
+                (
+                    entry["date"],
+                    entry["u_id"],
+                    entry["u_name"],
+                    entry["on_time"],
+                    entry["idx_hour"],
+                    hour,
+                    note,
+                )
+            )
+        if out.tell() >= CHUNK_SIZE:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+def _gzip(texts: Iterable[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for text in texts:
+        data: bytes = compressor.compress(text.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,14 @@
+"""gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`"""
+
+import multiprocessing
+
+from service_conf import BOT_SERVER_CONF
+
+bind = f"{BOT_SERVER_CONF['ip']}:{BOT_SERVER_CONF['port']}"
+workers = multiprocessing.cpu_count() * 2 + 1
+# threads keep a slow Synology round trip from blocking a whole worker
+worker_class = "gthread"
+threads = 4
+# every worker must build its own app, sqlite connections do not survive fork
+preload_app = False
+timeout = 60
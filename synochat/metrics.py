@@ -0,0 +1,270 @@
+"""Process metrics in the Prometheus text exposition format
+
+A tiny dependency-free subset of prometheus_client: counters, histograms
+with fixed buckets and callback gauges, all labelled by position. Recording
+costs one lock and a bisect, cheap enough to stay on in production.
+
+Metrics are per process. Under gunicorn every worker keeps its own, so
+scrape each worker or read them as samples of the pool.
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+    JobEvent,
+)
+from apscheduler.schedulers.base import BaseScheduler
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name: str = name
+        self.help: str = help_text
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text: str = _label_text(self.labelnames, labels)
+                lines.append(f"{self.name}{label_text} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name: str = name
+        self.help: str = help_text
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # per label set: bucket counts (last one is +Inf), sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx: int = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        names: Tuple[str, ...] = self.labelnames + ("le",)
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative: int = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le: str = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"{self.name}_bucket{_label_text(names, labels + (le,))} "
+                        f"{cumulative}"
+                    )
+                label_text: str = _label_text(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {total[0]}")
+                lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self.histogram: Histogram = histogram
+        self.labels: Labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start: float = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], float]) -> None:
+        self.name: str = name
+        self.help: str = help_text
+        self.func: Callable[[], float] = func
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {float(self.func())}",
+        ]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Counter | Histogram | Gauge] = {}
+
+    def register(self, metric: Counter | Histogram | Gauge) -> None:
+        # gauges are re-registered by every new server, the newest wins
+        self._metrics[metric.name] = metric
+
+    def counter(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]) -> Gauge:
+        metric = Gauge(name, help_text, func)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "synochat_webhook_seconds", "Inbound webhook handling time."
+)
+WEBHOOK_REPLAYS = REGISTRY.counter(
+    "synochat_webhook_replays_total", "Retried webhooks answered from the cache."
+)
+COMMAND_SECONDS = REGISTRY.histogram(
+    "synochat_command_seconds", "Command dispatch time by command.", ("command",)
+)
+OUTBOUND_SECONDS = REGISTRY.histogram(
+    "synochat_outbound_request_seconds",
+    "Outbound webhook post latency by service.",
+    ("service",),
+)
+OUTBOUND_ERRORS = REGISTRY.counter(
+    "synochat_outbound_errors_total", "Failed outbound webhook posts.", ("service",)
+)
+OUTBOUND_COALESCED = REGISTRY.counter(
+    "synochat_outbound_coalesced_total",
+    "Outbound messages merged into an earlier post to the same recipients.",
+    ("service",),
+)
+JOB_LAG_SECONDS = REGISTRY.histogram(
+    "synochat_job_lag_seconds",
+    "Delay between a scheduled job's planned and actual start.",
+    ("job",),
+)
+JOB_SECONDS = REGISTRY.histogram(
+    "synochat_job_seconds", "Scheduled job run time.", ("job",)
+)
+JOB_EVENTS = REGISTRY.counter(
+    "synochat_job_events_total", "Scheduled job outcomes.", ("job", "event")
+)
+
+
+def instrument_scheduler(scheduler: BaseScheduler) -> None:
+    """Record lag, duration and outcome of every job of `scheduler`."""
+    started: Dict[str, Tuple[str, float]] = {}
+    lock = threading.Lock()
+
+    def job_name(event: JobEvent) -> str:
+        job = scheduler.get_job(event.job_id)
+        return job.name if job is not None else event.job_id
+
+    def listener(event: JobEvent) -> None:
+        now: float = time.time()
+        if event.code == EVENT_JOB_SUBMITTED:
+            name: str = job_name(event)
+            for run_time in event.scheduled_run_times:
+                JOB_LAG_SECONDS.observe(max(0.0, now - run_time.timestamp()), name)
+            with lock:
+                started[event.job_id] = (name, now)
+            return
+        if event.code == EVENT_JOB_MISSED:
+            JOB_EVENTS.inc(job_name(event), "missed")
+            return
+        with lock:
+            name, start = started.pop(event.job_id, (job_name(event), now))
+        JOB_SECONDS.observe(now - start, name)
+        JOB_EVENTS.inc(name, "error" if event.code == EVENT_JOB_ERROR else "executed")
+
+    scheduler.add_listener(
+        listener,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+    )
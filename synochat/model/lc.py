@@ -1,23 +1,32 @@
-from typing import Dict, List, Optional
+import bisect
+import dataclasses
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
+class Tag:
+    """Topic tag of a challenge."""
+
+    name: str
+    slug: str
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class Challenge:
-    """Singleton Model class for daily challenge."""
+    """Immutable snapshot of one daily challenge."""
 
     title: str = ''
-    raw_tags: List[Dict[str, str]] = []
+    raw_tags: Tuple[Tag, ...] = ()
     ac_rate: float = 0
     difficulty: str = ''
     question_id: int = 0
     title_slug: str = ''
     date: str = ''
 
-    def __new__(cls):
-        """Override default class creation logic."""
-        if not hasattr(cls, 'instance'):  # NOQA : WPS421
-            cls.instance = super(Challenge, cls).__new__(cls)  # NOQA: WPS608
-        return cls.instance
-
     @property
     def problem_link(self) -> str:
         """Return the link of the problem."""
@@ -26,12 +35,20 @@ class Challenge:
         )
 
     @property
-    def tags(self) -> List[Optional[str]]:
-        """Return the link of the problem."""
-        tags = []
-        for tag in self.raw_tags:
-            tags.append(tag.get('name'))
-        return tags
+    def tags(self) -> List[str]:
+        """Return the tag names of the problem."""
+        return [tag.name for tag in self.raw_tags]
+
+    def to_dict(self) -> Dict:
+        """Return a json-serializable dict of the snapshot."""
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Challenge':
+        """Build a snapshot from `to_dict` output."""
+        fields = dict(data)
+        fields['raw_tags'] = tuple(Tag(**tag) for tag in data.get('raw_tags', ()))
+        return cls(**fields)
 
     def __str__(self) -> str:
         """Return the string rep of the class."""
@@ -42,3 +59,89 @@ class Challenge:
             self.question_id,
             self.tags,
         )
+
+
+class ChallengeHistory:
+    """Local history of daily challenges, one per date.
+
+    Challenges are indexed by date, difficulty and tag slug, so lookups
+    never touch the network. With a `path` every new challenge is appended
+    to an NDJSON file that is replayed on start; the last line of a date wins.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path: Optional[str] = path
+        self._by_date: Dict[str, Challenge] = {}
+        # sorted date lists
+        self._dates: List[str] = []
+        self._by_difficulty: Dict[str, List[str]] = {}
+        self._by_tag: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as history_file:
+                for line in history_file:
+                    if line.strip():
+                        self._index(Challenge.from_dict(json.loads(line)))
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f'Stopped reading challenge history {self.path}: {e}')
+
+    def _index(self, challenge: Challenge) -> bool:
+        old: Optional[Challenge] = self._by_date.get(challenge.date)
+        if old == challenge:
+            return False
+        if old is not None:
+            self._unindex(old)
+        self._by_date[challenge.date] = challenge
+        bisect.insort(self._dates, challenge.date)
+        bisect.insort(
+            self._by_difficulty.setdefault(challenge.difficulty.lower(), []),
+            challenge.date,
+        )
+        for tag in challenge.raw_tags:
+            bisect.insort(self._by_tag.setdefault(tag.slug, []), challenge.date)
+        return True
+
+    def _unindex(self, challenge: Challenge) -> None:
+        self._dates.remove(challenge.date)
+        self._by_difficulty[challenge.difficulty.lower()].remove(challenge.date)
+        for tag in challenge.raw_tags:
+            self._by_tag[tag.slug].remove(challenge.date)
+
+    def add(self, challenge: Challenge) -> None:
+        """Record a challenge, replacing an older snapshot of the same date."""
+        if not challenge.date:
+            return
+        with self._lock:
+            if not self._index(challenge):
+                return
+            if self.path:
+                with open(self.path, 'a') as history_file:
+                    history_file.write(json.dumps(challenge.to_dict()) + '\n')
+
+    def get(self, date: str) -> Optional[Challenge]:
+        return self._by_date.get(date)
+
+    def _pick(self, dates: Iterable[str]) -> List[Challenge]:
+        return [self._by_date[date] for date in dates]
+
+    def latest(self, count: int = 10) -> List[Challenge]:
+        """Return the newest `count` challenges, newest first."""
+        with self._lock:
+            return self._pick(reversed(self._dates[-count:]))
+
+    def by_difficulty(self, difficulty: str, count: int = 10) -> List[Challenge]:
+        with self._lock:
+            dates = self._by_difficulty.get(difficulty.lower(), [])
+            return self._pick(reversed(dates[-count:]))
+
+    def by_tag(self, slug: str, count: int = 10) -> List[Challenge]:
+        with self._lock:
+            return self._pick(reversed(self._by_tag.get(slug, [])[-count:]))
+
+    def __len__(self) -> int:
+        return len(self._by_date)
@@ -0,0 +1,163 @@
+"""Partition leases shared by several bot instances through SQLite
+
+Subscribers are split into `partitions` by a hash of their user id. Every
+node (one scheduler-running process per instance) heartbeats into the
+`nodes` table and holds time-limited leases on up to its fair share of
+partitions in the `leases` table. Only the lease holder sends a
+partition's reminders, so no reminder goes out twice. A node that stops
+renewing loses its leases after `ttl` seconds and the survivors claim them
+on their next renewal; a node that joins gets partitions as the others
+shrink to the new fair share.
+
+The lease database uses a rollback journal instead of WAL, so it can live
+on shared storage (NFS/SMB) that does not support WAL's shared memory.
+Nodes compare wall clocks, keep them in sync (NTP).
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import FrozenSet, List, Set, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node TEXT PRIMARY KEY,
+    seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    part INTEGER PRIMARY KEY,
+    node TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+def partition_of(u_id: int, partitions: int) -> int:
+    return zlib.crc32(str(u_id).encode()) % partitions
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class PartitionLeases:
+    """This node's view of the partition leases
+
+    `renew` is meant to run every `ttl / 3` seconds. Ownership is only
+    trusted locally until the expiry written by the last successful renewal,
+    so a node cut off from the database stops sending before anyone else
+    may take its partitions over.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        partitions: int,
+        ttl: float = 30.0,
+        node: str | None = None,
+    ) -> None:
+        self.path: str = path
+        self.partitions: int = partitions
+        self.ttl: float = ttl
+        self.node: str = node or default_node_id()
+        self._owned: FrozenSet[int] = frozenset()
+        self._valid_until: float = 0.0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+
+    def owned(self) -> FrozenSet[int]:
+        """Partitions held right now, empty once the leases ran out."""
+        if time.time() >= self._valid_until:
+            return frozenset()
+        return self._owned
+
+    def owns(self, u_id: int) -> bool:
+        return partition_of(u_id, self.partitions) in self.owned()
+
+    def renew(self) -> Tuple[Set[int], Set[int]]:
+        """Heartbeat, then extend, claim or release leases to the fair share.
+
+        Returns:
+            Tuple[Set[int], Set[int]]: partitions gained and lost since the
+                previous renewal
+        """
+        before: FrozenSet[int] = self.owned()
+        now: float = time.time()
+        try:
+            with self._lock:
+                owned: List[int] = self._claim(now)
+        except sqlite3.Error as e:
+            logging.error(f"Lease renewal of {self.node} failed: {e}")
+            return set(), set(before - self.owned())
+        self._owned = frozenset(owned)
+        self._valid_until = now + self.ttl
+        gained: Set[int] = set(self._owned - before)
+        lost: Set[int] = set(before - self._owned)
+        if gained or lost:
+            logging.info(
+                f"Node {self.node} owns partitions {sorted(self._owned)}, "
+                f"gained {sorted(gained)}, lost {sorted(lost)}"
+            )
+        return gained, lost
+
+    def _claim(self, now: float) -> List[int]:
+        # called with the lock held, one write transaction
+        conn: sqlite3.Connection = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)", (self.node, now))
+            conn.execute("DELETE FROM nodes WHERE seen < ?", (now - self.ttl,))
+            (live,) = conn.execute("SELECT COUNT(*) FROM nodes").fetchone()
+            share: int = -(-self.partitions // live)
+            mine: List[int] = []
+            taken: Set[int] = set()
+            for part, node, expires in conn.execute(
+                "SELECT part, node, expires FROM leases WHERE expires > ?", (now,)
+            ):
+                if node == self.node:
+                    mine.append(part)
+                else:
+                    taken.add(part)
+            mine.sort()
+            keep: List[int] = mine[:share]
+            free: List[int] = [
+                part
+                for part in range(self.partitions)
+                if part not in taken and part not in keep
+            ]
+            owned: List[int] = keep + free[: share - len(keep)]
+            # hand partitions above the fair share to nodes that joined
+            conn.executemany(
+                "DELETE FROM leases WHERE part = ? AND node = ?",
+                ((part, self.node) for part in mine[share:]),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                ((part, self.node, now + self.ttl) for part in owned),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return owned
+
+    def release(self) -> None:
+        """Give up every lease at once, e.g. on shutdown."""
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE node = ?", (self.node,))
+            self._conn.execute("DELETE FROM nodes WHERE node = ?", (self.node,))
+        self._owned = frozenset()
+        self._valid_until = 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
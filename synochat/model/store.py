@@ -0,0 +1,381 @@
+"""SQLite persistence for reminder subscribers and their notes"""
+
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Set, Tuple
+
+from model import subscribe
+
+SubRecord = subscribe.SubInfo | subscribe.SubRow
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    u_id INTEGER PRIMARY KEY,
+    u_name TEXT NOT NULL,
+    wait_for_reply INTEGER NOT NULL,
+    wait_time REAL NOT NULL,
+    sub_time REAL NOT NULL,
+    on_time REAL NOT NULL,
+    idx_hour INTEGER NOT NULL,
+    day INTEGER NOT NULL DEFAULT 0,
+    tz TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    u_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_user_hour ON notes (u_id, hour);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    u_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replies (
+    u_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    reply TEXT,
+    PRIMARY KEY (u_id, post_id)
+);
+CREATE INDEX IF NOT EXISTS replies_expires ON replies (expires);
+"""
+
+# change log entry meaning every subscriber changed
+ALL_USERS = -1
+
+# subscriber columns added after the first release, in order
+ADDED_COLUMNS = (
+    ("day", "INTEGER NOT NULL DEFAULT 0"),
+    ("tz", "TEXT NOT NULL DEFAULT ''"),
+)
+
+
+class SubStore:
+    """Write-through SQLite store behind the in-memory subscriber dicts
+
+    The database runs in WAL mode with one shared connection. Writes are
+    applied immediately but committed in batches: once `batch_size` writes
+    are pending, or when `flush` is called (the reminder service schedules it
+    every `flush_interval` seconds). A crash loses at most one batch.
+    Use ":memory:" as path for a throwaway store.
+
+    With `shared=True` several processes use the same database file: every
+    write is committed at once and logged by user id in the `changes` table,
+    so the other processes can refresh just those users with
+    `changes_since`. The newest `keep_changes` entries are kept. Webhook
+    replies are shared the same way (`claim_reply`), so a retried post is
+    handled once whichever process it lands on.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        shared: bool = False,
+        keep_changes: int = 10000,
+    ) -> None:
+        self.path: str = path
+        self.shared: bool = shared
+        self.keep_changes: int = keep_changes
+        self.batch_size: int = 1 if shared else batch_size
+        self.flush_interval: float = flush_interval
+        self._lock = threading.Lock()
+        self._pending: int = 0
+        self._conn: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level="DEFERRED"
+        )
+        if shared:
+            # WAL's shared memory is not safe across hosts on network storage
+            (mode,) = self._conn.execute("PRAGMA journal_mode=DELETE").fetchone()
+            if mode != "delete":
+                # leaving WAL needs the only connection to the database
+                logging.warning(f"Store {path} stays in {mode} journal mode")
+            self._conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(subscribers)")
+        }
+        for name, definition in ADDED_COLUMNS:
+            if name not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE subscribers ADD COLUMN {name} {definition}"
+                )
+        if "day" not in columns:
+            # stores from before lazy rollover: derive the day from on_time
+            self._conn.executemany(
+                "UPDATE subscribers SET day = ? WHERE u_id = ?",
+                [
+                    (
+                        subscribe.work_day(datetime.datetime.fromtimestamp(on_time)),
+                        u_id,
+                    )
+                    for u_id, on_time in self._conn.execute(
+                        "SELECT u_id, on_time FROM subscribers"
+                    ).fetchall()
+                ],
+            )
+
+    # writes
+    def _log_change(self, u_id: int) -> None:
+        if self.shared:
+            self._conn.execute("INSERT INTO changes (u_id) VALUES (?)", (u_id,))
+
+    def _write(self, sql: str, params: Tuple, u_id: int) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._log_change(u_id)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def _write_many(self, sql: str, rows: Iterable[Tuple]) -> None:
+        with self._lock:
+            rows = list(rows)
+            self._conn.executemany(sql, rows)
+            if self.shared:
+                self._conn.executemany(
+                    "INSERT INTO changes (u_id) VALUES (?)",
+                    ((row[0],) for row in rows),
+                )
+            self._pending += max(1, len(rows))
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def _commit(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+
+    def flush(self) -> None:
+        """Commit pending writes, trim the change log and expired replies."""
+        with self._lock:
+            if self.shared:
+                self._conn.execute(
+                    "DELETE FROM changes WHERE seq <= "
+                    "(SELECT MAX(seq) FROM changes) - ?",
+                    (self.keep_changes,),
+                )
+                self._conn.execute(
+                    "DELETE FROM replies WHERE expires <= ?", (time.time(),)
+                )
+                self._pending += 1
+            if self._pending:
+                self._commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._commit()
+            self._conn.close()
+
+    def upsert_sub(self, subinfo: SubRecord) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO subscribers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _sub_row(subinfo),
+            subinfo.u_id,
+        )
+
+    def upsert_subs(self, subinfos: Iterable[SubRecord]) -> None:
+        self._write_many(
+            "INSERT OR REPLACE INTO subscribers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (_sub_row(subinfo) for subinfo in subinfos),
+        )
+
+    def delete_sub(self, u_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM subscribers WHERE u_id = ?", (u_id,))
+            self._conn.execute("DELETE FROM notes WHERE u_id = ?", (u_id,))
+            self._log_change(u_id)
+            self._commit()
+
+    def append_note(self, u_id: int, hour: int, text: str) -> None:
+        self._write(
+            "INSERT INTO notes (u_id, hour, text) VALUES (?, ?, ?)",
+            (u_id, hour, text),
+            u_id,
+        )
+
+    def set_note(self, u_id: int, hour: int, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM notes WHERE u_id = ? AND hour = ?", (u_id, hour)
+            )
+            self._conn.execute(
+                "INSERT INTO notes (u_id, hour, text) VALUES (?, ?, ?)",
+                (u_id, hour, text),
+            )
+            self._log_change(u_id)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def roll_user(
+        self, u_id: int, on_time: datetime.datetime, day: int, tz: str
+    ) -> None:
+        """Mirror SubTable.roll: new day, on_time and tz, idx_hour 0, no notes."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE subscribers SET on_time = ?, idx_hour = 0, day = ?, tz = ? "
+                "WHERE u_id = ?",
+                (on_time.timestamp(), day, tz, u_id),
+            )
+            self._conn.execute("DELETE FROM notes WHERE u_id = ?", (u_id,))
+            self._log_change(u_id)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    # reads
+    # webhook replies, expiry in wall-clock seconds shared by the processes
+    def claim_reply(self, u_id: int, post_id: int, expires: float) -> bool:
+        """Claim handling post `post_id`, False when a process already has it."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO replies VALUES (?, ?, ?, NULL) "
+                "ON CONFLICT (u_id, post_id) DO UPDATE "
+                "SET expires = excluded.expires, reply = NULL "
+                "WHERE replies.expires <= ?",
+                (u_id, post_id, expires, time.time()),
+            )
+            self._commit()
+        return cursor.rowcount == 1
+
+    def set_reply(self, u_id: int, post_id: int, reply: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE replies SET reply = ? WHERE u_id = ? AND post_id = ?",
+                (reply, u_id, post_id),
+            )
+            self._commit()
+
+    def drop_reply(self, u_id: int, post_id: int) -> None:
+        """Release a claim whose handling failed, so a retry runs again."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM replies WHERE u_id = ? AND post_id = ?", (u_id, post_id)
+            )
+            self._commit()
+
+    def reply_of(self, u_id: int, post_id: int) -> Optional[str]:
+        """Reply of a claimed post, None while it is still being handled."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reply FROM replies WHERE u_id = ? AND post_id = ?",
+                (u_id, post_id),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def last_change(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def changes_since(self, seq: int) -> Tuple[int, Optional[Set[int]]]:
+        """User ids written by any process after change `seq`.
+
+        Returns:
+            Tuple[int, Optional[Set[int]]]: latest change seq, and the changed
+                user ids or None when everything must be reloaded
+        """
+        with self._lock:
+            first, last = self._conn.execute(
+                "SELECT MIN(seq), MAX(seq) FROM changes"
+            ).fetchone()
+            if last is None or last <= seq:
+                return seq, set()
+            if first > seq + 1:
+                # trimmed past our position
+                return last, None
+            u_ids: Set[int] = {
+                u_id
+                for (u_id,) in self._conn.execute(
+                    "SELECT DISTINCT u_id FROM changes WHERE seq > ?", (seq,)
+                )
+            }
+        if ALL_USERS in u_ids:
+            return last, None
+        return last, u_ids
+
+    def load_user(
+        self, u_id: int, hours: int
+    ) -> Optional[Tuple[subscribe.SubInfo, subscribe.NoteBuffer]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM subscribers WHERE u_id = ?", (u_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            notes = subscribe.NoteBuffer(hours)
+            for hour, text in self._conn.execute(
+                "SELECT hour, text FROM notes WHERE u_id = ? ORDER BY id", (u_id,)
+            ):
+                if 0 <= hour < hours:
+                    notes.append(hour, text)
+        return _sub_info(row), notes
+
+    def load(self, hours: int) -> subscribe.SubTable:
+        """Load every subscriber and their notes of the day.
+
+        Args:
+            hours (int): number of note slots per subscriber
+
+        Returns:
+            subscribe.SubTable: subscribers with their notes
+        """
+        start: float = time.perf_counter()
+        table = subscribe.SubTable()
+        with self._lock:
+            for row in self._conn.execute("SELECT * FROM subscribers"):
+                table.add(_sub_info(row), subscribe.NoteBuffer(hours))
+            for u_id, hour, text in self._conn.execute(
+                "SELECT u_id, hour, text FROM notes ORDER BY id"
+            ):
+                subrow = table.get(u_id)
+                if subrow is None or not 0 <= hour < hours:
+                    continue
+                subrow.notes.append(hour, text)
+        logging.info(
+            f"Loaded {len(table)} subscribers from {self.path} "
+            f"in {time.perf_counter() - start:.3f}s"
+        )
+        return table
+
+
+def _sub_info(row: Tuple) -> subscribe.SubInfo:
+    u_id, u_name, wait, wait_time, sub_time, on_time, idx_hour, day, tz = row
+    return subscribe.SubInfo(
+        wait_for_reply=bool(wait),
+        wait_time=datetime.datetime.fromtimestamp(wait_time),
+        u_id=u_id,
+        u_name=u_name,
+        sub_time=datetime.datetime.fromtimestamp(sub_time),
+        on_time=datetime.datetime.fromtimestamp(on_time),
+        idx_hour=idx_hour,
+        day=day,
+        tz=tz,
+    )
+
+
+def _sub_row(subinfo: SubRecord) -> Tuple:
+    return (
+        subinfo.u_id,
+        subinfo.u_name,
+        int(subinfo.wait_for_reply),
+        subinfo.wait_time.timestamp(),
+        subinfo.sub_time.timestamp(),
+        subinfo.on_time.timestamp(),
+        subinfo.idx_hour,
+        subinfo.day,
+        subinfo.tz,
+    )
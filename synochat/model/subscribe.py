@@ -1,6 +1,31 @@
 # all the dataclass for sub related service
+import array
 import dataclasses
 import datetime
+import heapq
+import sys
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# note slots per subscriber per day
+NOTE_HOURS = 8
+
+# a work day starts at DAY_START, on mon-fri, with on time at DEFAULT_ON_TIME
+DAY_START = datetime.time(hour=7, minute=30)
+DEFAULT_ON_TIME = datetime.time(hour=10, minute=30)
+
+
+def work_day(now: datetime.datetime) -> int:
+    """Day epoch (date ordinal) of the work day `now` belongs to.
+
+    The day flips at DAY_START, and weekends still belong to Friday.
+    """
+    date: datetime.date = now.date()
+    if now.time() < DAY_START:
+        date -= datetime.timedelta(days=1)
+    while date.weekday() >= 5:
+        date -= datetime.timedelta(days=1)
+    return date.toordinal()
 
 
 @dataclasses.dataclass
@@ -12,3 +37,417 @@ class SubInfo:
     sub_time: datetime.datetime
     on_time: datetime.datetime
     idx_hour: int
+    # work_day the on_time, idx_hour and notes belong to
+    day: int = 0
+    # IANA timezone name, "" for server-local time
+    tz: str = ""
+
+
+class NoteBuffer:
+    """A subscriber's notes of the day, one list of chunks per hour
+
+    Appending keeps the entry as its own chunk, so nothing is copied until
+    `render` joins an hour for display. `char_count` tracks the rendered
+    length of the whole day as entries come and go.
+    """
+
+    __slots__ = ("_hours", "_sizes", "char_count")
+
+    def __init__(self, hours: int) -> None:
+        self._hours: List[List[str]] = [[] for _ in range(hours)]
+        self._sizes: List[int] = [0] * hours
+        self.char_count: int = 0
+
+    def __len__(self) -> int:
+        return len(self._hours)
+
+    def __getitem__(self, hour: int) -> str:
+        return self.render(hour)
+
+    def __repr__(self) -> str:
+        return f"NoteBuffer({[self.render(i) for i in range(len(self))]!r})"
+
+    def _check(self, hour: int) -> None:
+        if not 0 <= hour < len(self._hours):
+            raise ValueError(
+                f"Note hour index {hour} out of range 0..{len(self._hours) - 1}"
+            )
+
+    def _resize(self, hour: int) -> None:
+        chunks: List[str] = self._hours[hour]
+        size: int = sum(len(chunk) for chunk in chunks) + max(0, len(chunks) - 1)
+        self.char_count += size - self._sizes[hour]
+        self._sizes[hour] = size
+
+    def append(self, hour: int, text: str) -> None:
+        self._check(hour)
+        chunks: List[str] = self._hours[hour]
+        chunks.append(text)
+        size: int = len(text) + (1 if len(chunks) > 1 else 0)
+        self._sizes[hour] += size
+        self.char_count += size
+
+    def replace(self, hour: int, text: str) -> None:
+        self._check(hour)
+        self._hours[hour] = [text] if text else []
+        self._resize(hour)
+
+    def render(self, hour: int) -> str:
+        self._check(hour)
+        return "\n".join(self._hours[hour])
+
+
+class SubRow:
+    """Attribute view of one subscriber row in a SubTable
+
+    Reads and writes go straight to the table columns, so a row behaves like
+    a SubInfo without owning any datetime objects itself.
+    """
+
+    __slots__ = ("_table", "u_id")
+
+    def __init__(self, table: "SubTable", u_id: int) -> None:
+        self._table: SubTable = table
+        self.u_id: int = u_id
+
+    @property
+    def _row(self) -> int:
+        return self._table._row[self.u_id]
+
+    @property
+    def u_name(self) -> str:
+        return self._table.u_name[self._row]
+
+    @property
+    def wait_for_reply(self) -> bool:
+        return self._table._get_wait(self._row)
+
+    @wait_for_reply.setter
+    def wait_for_reply(self, value: bool) -> None:
+        self._table._set_wait(self._row, value)
+
+    @property
+    def wait_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self._table.wait_time[self._row])
+
+    @wait_time.setter
+    def wait_time(self, value: datetime.datetime) -> None:
+        self._table.wait_time[self._row] = value.timestamp()
+
+    @property
+    def sub_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self._table.sub_time[self._row])
+
+    @property
+    def on_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self._table.on_time[self._row])
+
+    @on_time.setter
+    def on_time(self, value: datetime.datetime) -> None:
+        self._table.on_time[self._row] = value.timestamp()
+
+    @property
+    def idx_hour(self) -> int:
+        return self._table.idx_hour[self._row]
+
+    @idx_hour.setter
+    def idx_hour(self, value: int) -> None:
+        self._table.idx_hour[self._row] = value
+
+    @property
+    def day(self) -> int:
+        return self._table.day[self._row]
+
+    @property
+    def tz(self) -> str:
+        return self._table.tz[self._row]
+
+    @tz.setter
+    def tz(self, value: str) -> None:
+        self._table.tz[self._row] = sys.intern(value)
+
+    @property
+    def notes(self) -> NoteBuffer:
+        return self._table.notes[self._row]
+
+    @notes.setter
+    def notes(self, value: NoteBuffer) -> None:
+        self._table.notes[self._row] = value
+
+    def to_info(self) -> SubInfo:
+        return SubInfo(
+            wait_for_reply=self.wait_for_reply,
+            wait_time=self.wait_time,
+            u_id=self.u_id,
+            u_name=self.u_name,
+            sub_time=self.sub_time,
+            on_time=self.on_time,
+            idx_hour=self.idx_hour,
+            day=self.day,
+            tz=self.tz,
+        )
+
+    def __repr__(self) -> str:
+        return repr(self.to_info())
+
+
+class SubTable:
+    """Columnar subscriber table
+
+    Times are kept as epoch seconds in `array` columns, `wait_for_reply` as
+    one bit per row, and a single id->row dict is the only hash lookup per
+    access. Rows are removed by moving the last row into the hole, so the
+    columns stay dense and bulk operations walk plain arrays.
+    """
+
+    def __init__(self) -> None:
+        self._row: Dict[int, int] = {}
+        self.u_id: array.array = array.array("q")
+        self.u_name: List[str] = []
+        self.wait_time: array.array = array.array("d")
+        self.sub_time: array.array = array.array("d")
+        self.on_time: array.array = array.array("d")
+        self.idx_hour: array.array = array.array("i")
+        self.day: array.array = array.array("i")
+        # interned, a handful of distinct names
+        self.tz: List[str] = []
+        self.notes: List[NoteBuffer] = []
+        self._wait_bits: bytearray = bytearray()
+        # running totals so summary() stays O(1)
+        self._waiting: int = 0
+        self._name_bytes: int = 0
+        # guards row moves, single-cell reads and writes go unlocked
+        self._lock = threading.RLock()
+
+    # mapping protocol, keyed by user id
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def __contains__(self, u_id: object) -> bool:
+        return u_id in self._row
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._row)
+
+    def __getitem__(self, u_id: int) -> SubRow:
+        if u_id not in self._row:
+            raise KeyError(u_id)
+        return SubRow(self, u_id)
+
+    def get(self, u_id: int) -> Optional[SubRow]:
+        return SubRow(self, u_id) if u_id in self._row else None
+
+    def values(self) -> Iterator[SubRow]:
+        return (SubRow(self, u_id) for u_id in self.u_id)
+
+    def __repr__(self) -> str:
+        return f"SubTable(subscribers={len(self)}, waiting={self.waiting_count()})"
+
+    # wait_for_reply bitset
+    def _get_wait(self, row: int) -> bool:
+        return bool(self._wait_bits[row >> 3] & (1 << (row & 7)))
+
+    def _set_wait(self, row: int, value: bool) -> None:
+        mask: int = 1 << (row & 7)
+        old: bool = bool(self._wait_bits[row >> 3] & mask)
+        if value:
+            self._wait_bits[row >> 3] |= mask
+        else:
+            self._wait_bits[row >> 3] &= ~mask & 0xFF
+        self._waiting += int(value) - int(old)
+
+    def add(self, info: SubInfo, notes: NoteBuffer) -> SubRow:
+        with self._lock:
+            return self._add(info, notes)
+
+    def _add(self, info: SubInfo, notes: NoteBuffer) -> SubRow:
+        if info.u_id in self._row:
+            raise KeyError(f"duplicate subscriber {info.u_id}")
+        row: int = len(self.u_id)
+        self._row[info.u_id] = row
+        self.u_id.append(info.u_id)
+        self.u_name.append(info.u_name)
+        self._name_bytes += sys.getsizeof(info.u_name)
+        self.wait_time.append(info.wait_time.timestamp())
+        self.sub_time.append(info.sub_time.timestamp())
+        self.on_time.append(info.on_time.timestamp())
+        self.idx_hour.append(info.idx_hour)
+        self.day.append(info.day)
+        self.tz.append(sys.intern(info.tz))
+        self.notes.append(notes)
+        if row >> 3 >= len(self._wait_bits):
+            self._wait_bits.append(0)
+        self._set_wait(row, info.wait_for_reply)
+        return SubRow(self, info.u_id)
+
+    def remove(self, u_id: int) -> None:
+        with self._lock:
+            self._remove(u_id)
+
+    def _remove(self, u_id: int) -> None:
+        row: int = self._row.pop(u_id)
+        self._name_bytes -= sys.getsizeof(self.u_name[row])
+        last: int = len(self.u_id) - 1
+        if row != last:
+            moved: int = self.u_id[last]
+            self._row[moved] = row
+            self.u_id[row] = moved
+            self.u_name[row] = self.u_name[last]
+            self.wait_time[row] = self.wait_time[last]
+            self.sub_time[row] = self.sub_time[last]
+            self.on_time[row] = self.on_time[last]
+            self.idx_hour[row] = self.idx_hour[last]
+            self.day[row] = self.day[last]
+            self.tz[row] = self.tz[last]
+            self.notes[row] = self.notes[last]
+            self._set_wait(row, self._get_wait(last))
+        self._set_wait(last, False)
+        for column in (
+            self.u_id,
+            self.u_name,
+            self.wait_time,
+            self.sub_time,
+            self.on_time,
+            self.idx_hour,
+            self.day,
+            self.tz,
+            self.notes,
+        ):
+            column.pop()
+        if len(self._wait_bits) > (last + 7) >> 3:
+            self._wait_bits.pop()
+
+    def roll(
+        self,
+        u_id: int,
+        day: int,
+        on_time: datetime.datetime,
+        hours: int,
+        before: Optional[Callable[["SubRow"], None]] = None,
+    ) -> bool:
+        """Move a row to work day `day`, True when it belonged to another day.
+
+        The row gets `on_time`, idx_hour 0 and empty notes. `before` sees the
+        row of the old day first, once even when rolls race.
+        """
+        with self._lock:
+            row: int = self._row[u_id]
+            if self.day[row] == day:
+                return False
+            if before is not None:
+                before(SubRow(self, u_id))
+            self.day[row] = day
+            self.on_time[row] = on_time.timestamp()
+            self.idx_hour[row] = 0
+            self.notes[row] = NoteBuffer(hours)
+            return True
+
+    # bulk operations
+    def mark_reminded(self, u_ids: Iterable[int], now: datetime.datetime) -> None:
+        """Set wait_for_reply and recompute idx_hour for reminded users.
+
+        idx_hour stops at NOTE_HOURS, later replies go to the last hour.
+        """
+        now_ts: float = now.timestamp()
+        on_time, idx_hour, bits = self.on_time, self.idx_hour, self._wait_bits
+        with self._lock:
+            for u_id in u_ids:
+                row: int = self._row[u_id]
+                idx_hour[row] = min(int((now_ts - on_time[row]) // 3600), NOTE_HOURS)
+                mask: int = 1 << (row & 7)
+                if not bits[row >> 3] & mask:
+                    bits[row >> 3] |= mask
+                    self._waiting += 1
+
+    def waiting_count(self) -> int:
+        return self._waiting
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the table, notes excluded."""
+        size: int = sys.getsizeof(self._row) + sys.getsizeof(self._wait_bits)
+        for column in (
+            self.u_id,
+            self.wait_time,
+            self.sub_time,
+            self.on_time,
+            self.idx_hour,
+            self.day,
+            self.u_name,
+        ):
+            size += sys.getsizeof(column)
+        return size + self._name_bytes
+
+    def page(self, start: int, count: int) -> List[SubRow]:
+        """Rows start..start+count in table order, for paginated dumps."""
+        with self._lock:
+            return [SubRow(self, u_id) for u_id in self.u_id[start : start + count]]
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "subscribers": len(self),
+            "waiting_for_reply": self.waiting_count(),
+            "table_bytes": self.nbytes(),
+        }
+
+
+class DueIndex:
+    """Min-heap of user ids keyed by their next reminder instant
+
+    Every entry carries a sequence number unique to the index and the user
+    maps to the sequence of their live entry, so rescheduled or removed
+    users' stale entries are skipped lazily when they reach the top instead
+    of being searched for and removed.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, int]] = []
+        self._version: Dict[int, int] = {}
+        # never reused, a stale entry must not match a later schedule
+        self._seq: int = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._version)
+
+    def __contains__(self, u_id: int) -> bool:
+        return u_id in self._version
+
+    def schedule(self, u_id: int, due: datetime.datetime) -> None:
+        with self._lock:
+            self._seq += 1
+            version: int = self._seq
+            self._version[u_id] = version
+            heapq.heappush(self._heap, (due.timestamp(), u_id, version))
+
+    def remove(self, u_id: int) -> None:
+        with self._lock:
+            self._version.pop(u_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+            self._version.clear()
+
+    def pop_due(self, now: datetime.datetime) -> List[int]:
+        """Remove and return every user whose reminder is due at `now`.
+
+        Popped users are no longer scheduled until `schedule` is called again.
+        """
+        now_ts: float = now.timestamp()
+        due: List[int] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now_ts:
+                _ts, u_id, version = heapq.heappop(self._heap)
+                if self._version.get(u_id) != version:
+                    continue
+                del self._version[u_id]
+                due.append(u_id)
+            # drop stale entries if they dominate the heap
+            if len(self._heap) > 2 * len(self._version) + 64:
+                self._heap = [
+                    entry
+                    for entry in self._heap
+                    if self._version.get(entry[1]) == entry[2]
+                ]
+                heapq.heapify(self._heap)
+        return due
@@ -1,9 +1,15 @@
+import atexit
 import dataclasses
 import datetime
 import logging
-from typing import Optional, TypedDict
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
 
-from api import chat
+from api import chat, outbound, session
+
+# seconds between attempts while the user list could never be loaded
+FIRST_LOAD_RETRY = 60.0
 
 
 class ReturnDict(TypedDict, total=False):
@@ -42,6 +48,127 @@ class UserData:
     user_props: UserProp
 
 
+def _from_raw(cls: type, raw: Dict[str, Any], **nested: Any) -> Any:
+    # keep known fields only, synology adds new ones without notice
+    names = {field.name for field in dataclasses.fields(cls)}
+    values = {key: value for key, value in raw.items() if key in names}
+    values.update(nested)
+    for field in dataclasses.fields(cls):
+        values.setdefault(field.name, None)
+    return cls(**values)
+
+
+def parse_user(raw: Dict[str, Any]) -> UserData:
+    """Build UserData from one entry of the user_list api."""
+    raw_props: Dict[str, Any] = raw.get("user_props") or {}
+    props: UserProp = _from_raw(
+        UserProp,
+        raw_props,
+        key_pair=_from_raw(KeyPair, raw_props.get("key_pair") or {}),
+    )
+    return _from_raw(UserData, raw, user_props=props)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class _Directory:
+    users: Tuple[UserData, ...] = ()
+    by_id: Dict[int, UserData] = dataclasses.field(default_factory=dict)
+    by_username: Dict[str, UserData] = dataclasses.field(default_factory=dict)
+    by_nickname: Dict[str, Tuple[UserData, ...]] = dataclasses.field(
+        default_factory=dict
+    )
+    loaded_at: float = 0.0
+
+
+class UserDirectory:
+    """Synology user list parsed once and indexed for lookups
+
+    Users are indexed by user_id, username and nickname (names are matched
+    case-insensitively). Indexes live in one immutable snapshot that a
+    refresh rebuilds and swaps in, so readers never wait on a refresh. A read
+    after `ttl` seconds starts a refresh in the background and is answered
+    from the current snapshot. The first read starts the first load the same
+    way, and reads find no users until it is done. After a failed refresh
+    nothing is fetched again for `ttl` seconds, or FIRST_LOAD_RETRY seconds
+    while no user list was ever loaded.
+    """
+
+    def __init__(self, fetch: Callable[[], List[Dict]], ttl: float = 600.0) -> None:
+        self.fetch: Callable[[], List[Dict]] = fetch
+        self.ttl: float = ttl
+        self._dir: _Directory = _Directory()
+        self._refresh_lock = threading.Lock()
+        # monotonic time of the last refresh attempt, failed or not
+        self._tried_at: float = 0.0
+
+    def refresh(self) -> bool:
+        """Fetch the user list and swap in new indexes, False on failure."""
+        with self._refresh_lock:
+            self._tried_at = time.monotonic()
+            try:
+                raw_users: List[Dict] = self.fetch()
+                users: Tuple[UserData, ...] = tuple(
+                    parse_user(raw) for raw in raw_users
+                )
+            except Exception as e:
+                logging.error(f"User directory refresh failed: {e}")
+                return False
+            by_nickname: Dict[str, Tuple[UserData, ...]] = {}
+            for user in users:
+                if user.nickname:
+                    key: str = user.nickname.lower()
+                    by_nickname[key] = by_nickname.get(key, ()) + (user,)
+            self._dir = _Directory(
+                users=users,
+                by_id={user.user_id: user for user in users},
+                by_username={
+                    user.username.lower(): user for user in users if user.username
+                },
+                by_nickname=by_nickname,
+                loaded_at=time.monotonic(),
+            )
+        logging.info(f"User directory loaded {len(users)} users")
+        return True
+
+    def _current(self) -> _Directory:
+        directory: _Directory = self._dir
+        wait: float = (
+            self.ttl if directory.loaded_at else min(self.ttl, FIRST_LOAD_RETRY)
+        )
+        stale: bool = not self._tried_at or time.monotonic() - self._tried_at >= wait
+        if stale and not self._refresh_lock.locked():
+            # keep further reads from starting more threads meanwhile
+            self._tried_at = time.monotonic()
+            threading.Thread(
+                target=self.refresh, name="user-directory", daemon=True
+            ).start()
+        return directory
+
+    def get(self, user_id: int) -> Optional[UserData]:
+        return self._current().by_id.get(int(user_id))
+
+    def by_username(self, username: str) -> Optional[UserData]:
+        return self._current().by_username.get(username.lower())
+
+    def by_nickname(self, nickname: str) -> Tuple[UserData, ...]:
+        return self._current().by_nickname.get(nickname.lower(), ())
+
+    def find(self, name: str) -> Optional[UserData]:
+        """Resolve a username, or a nickname shared by exactly one user."""
+        name = name.lstrip("@")
+        user: Optional[UserData] = self.by_username(name)
+        if user is not None:
+            return user
+        matches: Tuple[UserData, ...] = self.by_nickname(name)
+        return matches[0] if len(matches) == 1 else None
+
+    def users(self) -> Tuple[UserData, ...]:
+        return self._current().users
+
+    def __len__(self) -> int:
+        return len(self._dir.users)
+
+
 @dataclasses.dataclass
 class PostEvent:
     token: str  # 'G9ZQiNZxUQG4SMlvrHlyfSFQblrk1mPYYpeWmJFgpevv5VIw8SrDBn40LEwZWuYw',
@@ -71,6 +198,17 @@ class ChatService:
 
     typically, a channel service is used for announcing info, so the
     url_incoming is fixed, and token_outgoing is optional
+
+    Both web_post and web_get share one keep-alive connection pool, sized by
+    pool_size and dropped after idle_timeout seconds without traffic.
+    Outgoing posts are queued and sent by send_workers threads, with at most
+    queue_size messages pending; send_workers=0 sends inline. Batched posts
+    address at most max_recipients users each. Messages to the same users
+    within coalesce_window seconds are merged into one post. Posts still
+    waiting are sent when the process exits, see `close`.
+
+    With a token, `users` is a UserDirectory over the server's user list,
+    refreshed every users_ttl seconds.
     """
 
     def __init__(
@@ -79,20 +217,56 @@ class ChatService:
         server_url: str,
         incoming_url: str,
         token: Optional[str] = "",
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        idle_timeout: float = 60.0,
+        send_workers: int = 4,
+        queue_size: int = 1000,
+        max_recipients: int = 50,
+        users_ttl: float = 600.0,
+        coalesce_window: float = 0.2,
     ) -> None:
         self.name: str = service_name
         self.server: str = server_url
         self._url_incoming: str = incoming_url
         self._token: Optional[str] = token
 
-        self.web_post = chat.WebhookPostService(self._url_incoming)
+        self.http = session.HttpSession(
+            pool_size=pool_size, keep_alive=keep_alive, idle_timeout=idle_timeout
+        )
+        self.outbound = outbound.OutboundQueue(
+            workers=send_workers, maxsize=queue_size, name=self.name
+        )
+        self.web_post = chat.WebhookPostService(
+            self._url_incoming,
+            http=self.http,
+            queue=self.outbound,
+            max_recipients=max_recipients,
+            coalesce_window=coalesce_window,
+        )
         self.web_get: chat.WebhookGetService | None = (
-            chat.WebhookGetService(self.server, self._token) if self._token else None
+            chat.WebhookGetService(self.server, self._token, http=self.http)
+            if self._token
+            else None
+        )
+
+        self.users: UserDirectory | None = (
+            UserDirectory(self.web_get.check_aval_users, ttl=users_ttl)
+            if self.web_get is not None
+            else None
         )
 
         if self.web_get is None:
             logging.warning(f"ChatService with Name:{self.name} has no get service.")
 
+        # sender threads are daemons, drain them before the process goes away
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Send merged and queued posts, then stop the sender threads."""
+        self.web_post.flush()
+        self.outbound.stop()
+
 
 @dataclasses.dataclass
 class Bot(ChatService):
@@ -107,5 +281,26 @@ class Bot(ChatService):
         server_url: str,
         incoming_url: str,
         token: str,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        idle_timeout: float = 60.0,
+        send_workers: int = 4,
+        queue_size: int = 1000,
+        max_recipients: int = 50,
+        users_ttl: float = 600.0,
+        coalesce_window: float = 0.2,
     ) -> None:
-        super().__init__(service_name, server_url, incoming_url, token)
+        super().__init__(
+            service_name,
+            server_url,
+            incoming_url,
+            token,
+            pool_size=pool_size,
+            keep_alive=keep_alive,
+            idle_timeout=idle_timeout,
+            send_workers=send_workers,
+            queue_size=queue_size,
+            max_recipients=max_recipients,
+            users_ttl=users_ttl,
+            coalesce_window=coalesce_window,
+        )
@@ -0,0 +1,181 @@
+"""Timezone buckets with per-bucket reminder windows
+
+Subscribers are grouped by the IANA timezone of their Synology Chat profile
+(`UserProp.timezoneUTC`). Every bucket keeps its own due index and the UTC
+timestamps of its next window and day boundaries, so the per-tick work only
+touches buckets that are inside working hours right now, however many
+timezones the team spans. The empty zone name stands for the server's local
+timezone, used when a user has no (known) timezone.
+"""
+
+import datetime
+import heapq
+import logging
+import threading
+import zoneinfo
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+
+from model import subscribe
+
+# reminders go out from WORK_START until WORK_END local time, mon-fri
+WORK_START = datetime.time(hour=9)
+WORK_END = datetime.time(hour=22)
+
+LOCAL = ""
+
+Window = Tuple[datetime.time, datetime.time]
+
+
+class Zone:
+    """One timezone bucket: its subscribers' due index and window boundaries"""
+
+    def __init__(
+        self, name: str, tz: Optional[datetime.tzinfo], window: Window
+    ) -> None:
+        self.name: str = name
+        self.tz: Optional[datetime.tzinfo] = tz
+        self.window: Window = window
+        self.due: subscribe.DueIndex = subscribe.DueIndex()
+        # current or next window as UTC timestamps
+        self.opens: float = 0.0
+        self.closes: float = 0.0
+        # work day epoch and the UTC timestamp it ends at
+        self._day: int = 0
+        self._day_ends: float = 0.0
+
+    def local(self, moment: datetime.datetime) -> datetime.datetime:
+        """`moment` as naive wall-clock time of this zone."""
+        return datetime.datetime.fromtimestamp(moment.timestamp(), self.tz).replace(
+            tzinfo=None
+        )
+
+    def _at(self, date: datetime.date, time: datetime.time) -> datetime.datetime:
+        # wall-clock time of this zone as naive server-local time
+        return (
+            datetime.datetime.combine(date, time, tzinfo=self.tz)
+            .astimezone()
+            .replace(tzinfo=None)
+        )
+
+    def work_day(self, now: datetime.datetime) -> int:
+        now_ts: float = now.timestamp()
+        if now_ts >= self._day_ends:
+            local: datetime.datetime = self.local(now)
+            self._day = subscribe.work_day(local)
+            ends = datetime.datetime.combine(local.date(), subscribe.DAY_START)
+            if ends <= local:
+                ends += datetime.timedelta(days=1)
+            self._day_ends = self._at(ends.date(), subscribe.DAY_START).timestamp()
+        return self._day
+
+    def on_time(self, day: int) -> datetime.datetime:
+        """Default on_time of work day `day`, in server-local time."""
+        return self._at(datetime.date.fromordinal(day), subscribe.DEFAULT_ON_TIME)
+
+    def next_window(self, now: datetime.datetime) -> None:
+        """Set opens/closes to the window containing `now` or the next one."""
+        now_ts: float = now.timestamp()
+        date: datetime.date = self.local(now).date()
+        start, end = self.window
+        while True:
+            if date.weekday() < 5:
+                closes: float = self._at(date, end).timestamp()
+                if closes > now_ts:
+                    self.opens = self._at(date, start).timestamp()
+                    self.closes = closes
+                    return
+            date += datetime.timedelta(days=1)
+
+
+class ZoneIndex:
+    """Zones by name plus a heap of their upcoming window boundaries
+
+    `open_zones` only pops boundaries that have passed, so a tick costs
+    O(open zones) plus one heap operation per window opening or closing.
+    `windows` overrides the working hours per zone name, as "HH:MM" pairs.
+    """
+
+    def __init__(
+        self,
+        windows: Optional[Mapping[str, Tuple[str, str]]] = None,
+        default: Window = (WORK_START, WORK_END),
+    ) -> None:
+        self.default: Window = default
+        self.windows: Dict[str, Window] = {
+            name: (
+                datetime.time.fromisoformat(start),
+                datetime.time.fromisoformat(end),
+            )
+            for name, (start, end) in (windows or {}).items()
+        }
+        self._zones: Dict[str, Zone] = {}
+        # names zoneinfo does not know, bucketed as local time
+        self._unknown: Set[str] = set()
+        self._open: Dict[str, Zone] = {}
+        self._boundaries: List[Tuple[float, str]] = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return sum(len(zone.due) for zone in list(self._zones.values()))
+
+    def zone(self, name: str) -> Zone:
+        """Bucket of timezone `name`, created on first use."""
+        zone: Optional[Zone] = self._zones.get(name)
+        if zone is not None:
+            return zone
+        if name in self._unknown:
+            return self.zone(LOCAL)
+        with self._lock:
+            if name in self._zones:
+                return self._zones[name]
+            tz: Optional[datetime.tzinfo] = None
+            if name != LOCAL:
+                try:
+                    tz = zoneinfo.ZoneInfo(name)
+                except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+                    logging.warning(f"Unknown timezone {name!r}, using local time")
+                    self._unknown.add(name)
+                    return self.zone(LOCAL)
+            zone = Zone(name, tz, self.windows.get(name, self.default))
+            self._advance(zone, datetime.datetime.now())
+            self._zones[name] = zone
+        return zone
+
+    def _advance(self, zone: Zone, now: datetime.datetime) -> None:
+        # called with the lock held
+        if now.timestamp() >= zone.closes:
+            zone.next_window(now)
+        if zone.opens <= now.timestamp():
+            self._open[zone.name] = zone
+            heapq.heappush(self._boundaries, (zone.closes, zone.name))
+        else:
+            self._open.pop(zone.name, None)
+            heapq.heappush(self._boundaries, (zone.opens, zone.name))
+
+    def open_zones(self, now: datetime.datetime) -> List[Zone]:
+        """Zones inside their reminder window at `now`."""
+        now_ts: float = now.timestamp()
+        with self._lock:
+            while self._boundaries and self._boundaries[0][0] <= now_ts:
+                _ts, name = heapq.heappop(self._boundaries)
+                self._advance(self._zones[name], now)
+            return list(self._open.values())
+
+    def schedule(self, u_id: int, name: str, due: datetime.datetime) -> None:
+        self.zone(name).due.schedule(u_id, due)
+
+    def remove(self, u_id: int, name: str) -> None:
+        self.zone(name).due.remove(u_id)
+
+    def clear(self) -> None:
+        for zone in list(self._zones.values()):
+            zone.due.clear()
+
+    def summary(self) -> Dict[str, Dict[str, object]]:
+        return {
+            zone.name or "local": {
+                "open": zone.name in self._open,
+                "due": len(zone.due),
+            }
+            for zone in list(self._zones.values())
+        }
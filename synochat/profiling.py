@@ -0,0 +1,208 @@
+"""On-demand CPU and memory profiling for a running server
+
+`Profiler` runs cProfile around webhook handling and scheduler jobs only
+while it is started, and writes the merged result as a pstats file
+(open it with `python -m pstats`, snakeviz or flameprof for a flamegraph).
+`MemoryTracker` takes tracemalloc snapshots and diffs them against the
+previous one to show which allocation sites grow.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# stack depth kept per traced allocation
+TRACE_FRAMES = 5
+
+
+class Profiler:
+    """Deterministic profiler switched on and off at runtime
+
+    Each thread entering a profiled section gets its own cProfile.Profile,
+    since one profile cannot be enabled from several threads at once. `stop`
+    merges them. Sections cost a single attribute check while stopped.
+    """
+
+    def __init__(self, out_dir: str = ".") -> None:
+        self.out_dir: str = out_dir
+        self.active: bool = False
+        self.started_at: Optional[datetime.datetime] = None
+        self._profiles: List[cProfile.Profile] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._running: int = 0
+        self._generation: int = 0
+
+    def start(self) -> bool:
+        """Start collecting, False when already running."""
+        with self._lock:
+            if self.active:
+                return False
+            self._profiles = []
+            self._generation += 1
+            self.started_at = datetime.datetime.now()
+            self.active = True
+        logging.info("Profiler started")
+        return True
+
+    def stop(self, top: int = 15) -> Optional[str]:
+        """Stop collecting and dump the stats.
+
+        Returns:
+            Optional[str]: dump path and the top functions by cumulative
+                time, or None when the profiler was not running
+        """
+        with self._idle:
+            if not self.active:
+                return None
+            self.active = False
+            # let sections still running disable their profile, except the
+            # caller's own when stopped from inside a profiled webhook
+            own: int = getattr(self._local, "running", 0)
+            self._idle.wait_for(lambda: self._running <= own, timeout=10)
+            profiles: List[cProfile.Profile] = self._profiles
+            self._profiles = []
+        if not profiles:
+            return "Profiler stopped, nothing was profiled."
+        report = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=report)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path: str = os.path.join(
+            self.out_dir, f"profile-{self.started_at:%Y%m%d-%H%M%S}.pstats"
+        )
+        stats.dump_stats(path)
+        stats.sort_stats("cumulative").print_stats(top)
+        logging.info(f"Profiler stopped, stats written to {path}")
+        return f"Profile written to {path}\n{report.getvalue()}"
+
+    def _thread_profile(self) -> cProfile.Profile:
+        # called with the lock held
+        if getattr(self._local, "generation", None) != self._generation:
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            self._local.profile = profile
+            self._local.generation = self._generation
+        return self._local.profile
+
+    @contextlib.contextmanager
+    def section(self) -> Iterator[None]:
+        """Profile the enclosed block while the profiler is active."""
+        if not self.active:
+            yield
+            return
+        with self._idle:
+            if not self.active:
+                profile: Optional[cProfile.Profile] = None
+            else:
+                profile = self._thread_profile()
+                self._running += 1
+        if profile is None:
+            yield
+            return
+        self._local.running = getattr(self._local, "running", 0) + 1
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler owns the interpreter (python >= 3.12)
+                yield
+                return
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._local.running -= 1
+            with self._idle:
+                self._running -= 1
+                self._idle.notify_all()
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap a job function so its runs are profiled."""
+
+        @functools.wraps(func)
+        def profiled(*args: Any, **kwargs: Any) -> Any:
+            with self.section():
+                return func(*args, **kwargs)
+
+        return profiled
+
+
+class MemoryTracker:
+    """tracemalloc snapshots diffed against the previous snapshot
+
+    Tracing starts with the first snapshot, so only allocations made after it
+    are seen. `sizes` returns named structure sizes reported next to the
+    allocation sites.
+    """
+
+    def __init__(self, sizes: Optional[Callable[[], Dict[str, Any]]] = None) -> None:
+        self.sizes: Optional[Callable[[], Dict[str, Any]]] = sizes
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_sizes: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _take(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+
+    def _sizes_text(self) -> str:
+        if self.sizes is None:
+            return ""
+        current: Dict[str, Any] = self.sizes()
+        lines: List[str] = []
+        for name, value in current.items():
+            before: Any = self._baseline_sizes.get(name)
+            delta: str = f" ({value - before:+})" if before is not None else ""
+            lines.append(f"{name}: {value}{delta}")
+        self._baseline_sizes = current
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, top: int = 10) -> str:
+        """Start tracing if needed and record a new baseline."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+                self._baseline = self._take()
+                return "Started tracing allocations.\n" + self._sizes_text()
+            self._baseline = self._take()
+            current, peak = tracemalloc.get_traced_memory()
+            lines: List[str] = [f"Traced {current} B, peak {peak} B"]
+            for stat in self._baseline.statistics("lineno")[:top]:
+                lines.append(str(stat))
+            return self._sizes_text() + "\n".join(lines)
+
+    def diff(self, top: int = 10) -> str:
+        """Allocation growth since the last snapshot, which is then replaced."""
+        with self._lock:
+            if self._baseline is None or not tracemalloc.is_tracing():
+                return "No snapshot yet, run `_mem snapshot` first."
+            new: tracemalloc.Snapshot = self._take()
+            lines: List[str] = [
+                str(stat) for stat in new.compare_to(self._baseline, "lineno")[:top]
+            ]
+            self._baseline = new
+            return self._sizes_text() + "\n".join(lines)
+
+    def stop(self) -> str:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return "Not tracing."
+            tracemalloc.stop()
+            self._baseline = None
+            self._baseline_sizes = {}
+            return "Stopped tracing allocations."
@@ -0,0 +1,149 @@
+"""Replies of recently handled webhooks, replayed to Synology's retries"""
+
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, OrderedDict, Tuple
+
+from model import store, syno
+
+# seconds between looks at a reply another process is still working on
+SHARED_POLL = 0.05
+
+Key = Tuple[int, int]
+
+
+class _Entry:
+    __slots__ = ("expires", "done", "reply")
+
+    def __init__(self, expires: float) -> None:
+        self.expires: float = expires
+        self.done = threading.Event()
+        self.reply: Optional[syno.ReturnDict] = None
+
+
+class ReplayCache:
+    """Bounded LRU of webhook replies, keyed by post and kept for `window` seconds
+
+    Synology resends an outgoing webhook when the reply is slow, with the
+    same post_id. `run` handles a key once and hands every later request for
+    it the cached reply, without running the handler again. A retry arriving
+    while the first request is still running waits up to `wait` seconds for
+    its reply, and gets an empty reply after that rather than a second run.
+    A handler that raises caches nothing, so the next retry runs again.
+
+    Keys are (user_id, post_id). Each process keeps its own LRU; with a
+    `shared` store, a key missing from it is claimed in the store as well,
+    so a retry landing on another worker or instance replays the reply the
+    first one stored instead of handling the post again. A store error
+    falls back to handling the post.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        window: float = 600.0,
+        wait: float = 30.0,
+        shared: store.SubStore | None = None,
+    ) -> None:
+        self.max_entries: int = max_entries
+        self.window: float = window
+        self.wait: float = wait
+        self.shared: store.SubStore | None = shared
+        self._entries: OrderedDict[Key, _Entry] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float) -> None:
+        # called with the lock held, oldest entries are at the front
+        entries = self._entries
+        while entries:
+            oldest: _Entry = next(iter(entries.values()))
+            if len(entries) <= self.max_entries and oldest.expires > now:
+                break
+            entries.popitem(last=False)
+
+    def run(
+        self, key: Key, handler: Callable[[], syno.ReturnDict]
+    ) -> Tuple[syno.ReturnDict, bool]:
+        """Reply for `key`, from the cache or by calling `handler`.
+
+        Returns:
+            Tuple[syno.ReturnDict, bool]: the reply, and whether it was replayed
+        """
+        now: float = time.monotonic()
+        with self._lock:
+            entry: Optional[_Entry] = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(key)
+                owner: bool = False
+            else:
+                entry = self._entries[key] = _Entry(now + self.window)
+                self._entries.move_to_end(key)
+                self._evict(now)
+                owner = True
+
+        if not owner:
+            entry.done.wait(self.wait)
+            return (entry.reply if entry.reply is not None else {}), True
+
+        try:
+            if self.shared is None:
+                entry.reply, replayed = handler(), False
+            else:
+                entry.reply, replayed = self._run_shared(self.shared, key, handler)
+        except BaseException:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry.done.set()
+        return entry.reply, replayed
+
+    def _run_shared(
+        self,
+        shared: store.SubStore,
+        key: Key,
+        handler: Callable[[], syno.ReturnDict],
+    ) -> Tuple[syno.ReturnDict, bool]:
+        u_id, post_id = key
+        deadline: float = time.monotonic() + self.wait
+        while True:
+            try:
+                claimed: bool = shared.claim_reply(
+                    u_id, post_id, time.time() + self.window
+                )
+                text: Optional[str] = (
+                    None if claimed else shared.reply_of(u_id, post_id)
+                )
+            except sqlite3.Error as e:
+                logging.error(f"Shared reply lookup of {key} failed: {e}")
+                return handler(), False
+            if claimed:
+                break
+            if text is not None:
+                return json.loads(text), True
+            # still running elsewhere, or released after failing there
+            if time.monotonic() >= deadline:
+                return {}, True
+            time.sleep(SHARED_POLL)
+
+        try:
+            reply: syno.ReturnDict = handler()
+        except BaseException:
+            try:
+                shared.drop_reply(u_id, post_id)
+            except sqlite3.Error as e:
+                logging.error(f"Releasing shared reply of {key} failed: {e}")
+            raise
+        try:
+            shared.set_reply(u_id, post_id, json.dumps(reply))
+        except sqlite3.Error as e:
+            logging.error(f"Storing shared reply of {key} failed: {e}")
+        return reply, False
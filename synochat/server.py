@@ -1,16 +1,24 @@
 """Server class for combining web server and services"""
 
+import atexit
 import datetime
+import hmac
 import logging
 import os
 import pprint
-from typing import List
+from typing import Iterable, Mapping, Tuple
 
+import export
+import metrics
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, Response, request, send_file
-from model import syno
-from service import reminder
-from service_conf import BOT_CONF, BOT_SERVER_CONF, ServiceConf
+from api.daily import ChallengeCache
+from flask import Flask, Response, request
+from model import lc, lease, store, syno
+from profiling import Profiler
+from replay import ReplayCache
+from service import command, reminder
+from service_conf import ServiceConf
+from static import AssetStore
 from werkzeug.datastructures.structures import ImmutableMultiDict
 
 SERVER_HELP_NOTE = """
@@ -30,11 +38,6 @@ SERVER_PROGRESS = """
     1. Restructured server.
 """
 
-# add service name if create new service
-SERVICES = """
-*reminder* : hourly remind for work summary, for more info, see `help` after subscribe.
-"""
-
 
 class ServiceServer(Flask):
     def __init__(
@@ -43,8 +46,18 @@ class ServiceServer(Flask):
         host: str,
         port: int,
         bot_service_conf: ServiceConf,
+        store_path: str = "synochat.db",
+        shared_store: bool = False,
+        replay_window: float = 600.0,
+        export_token: str | None = None,
+        admin_ids: Iterable[int] = (),
+        reminder_windows: Mapping[str, Tuple[str, str]] | None = None,
+        partitions: int = 0,
+        lease_path: str | None = None,
+        lease_seconds: float = 30.0,
     ) -> None:
-        super().__init__(import_name=name)
+        # assets are served from memory by self.assets, not flask's static folder
+        super().__init__(import_name=name, static_folder=None)
         self.syno_api = syno.Bot(
             service_name=bot_service_conf["service_name"],
             server_url=bot_service_conf["server_url"],
@@ -52,82 +65,133 @@ class ServiceServer(Flask):
             token=bot_service_conf["token"],
         )
         self.schedular = BackgroundScheduler()
+        metrics.instrument_scheduler(self.schedular)
         # info
         self.host: str = host
         self.port: int = port
+        # profiles are dumped next to the store
+        self.profiler: Profiler = Profiler(
+            out_dir=os.path.dirname(os.path.abspath(store_path))
+        )
+        # finished days of notes, downloadable with export_token
+        self.exporter: export.DayExporter = export.DayExporter(
+            store_path + ".export"
+        )
+        atexit.register(self.exporter.close)
+        self.export_token: str | None = export_token
         # service
+        self.store: store.SubStore = store.SubStore(store_path, shared=shared_store)
+        # several instances split the reminders by partition leases
+        self.leases: lease.PartitionLeases | None = None
+        if partitions > 0:
+            self.leases = lease.PartitionLeases(
+                lease_path or store_path + ".leases", partitions, ttl=lease_seconds
+            )
         self.agnomer: reminder.Agnomeing = reminder.Agnomeing(
-            chat_api=self.syno_api, scheduler=self.schedular
+            chat_api=self.syno_api,
+            scheduler=self.schedular,
+            sub_store=self.store,
+            challenge_cache=ChallengeCache(
+                path=store_path + ".leetcode.json",
+                history=lc.ChallengeHistory(store_path + ".leetcode.ndjson"),
+            ),
+            profiler=self.profiler,
+            admin_ids=admin_ids,
+            zone_windows=reminder_windows,
+            leases=self.leases,
+            exporter=self.exporter,
+        )
+        # commands, services register theirs into one table
+        self.registry: command.CommandRegistry = command.CommandRegistry(
+            fallback=self.check_input
+        )
+        self.registry.add("help", lambda cmd: self.show_help(cmd.event))
+        self.registry.add("service", lambda cmd: self.show_service())
+        self.registry.add("progress", lambda cmd: self.show_progress(cmd.event))
+        service_arg = (command.Arg("service", required=False, default=" "),)
+        self.registry.add(
+            "sub", lambda cmd: self.register_service(cmd, True), service_arg
         )
+        self.registry.add(
+            "unsub", lambda cmd: self.register_service(cmd, False), service_arg
+        )
+        self.registry.include(self.agnomer.registry)
+        # synology retries slow webhooks with the same post_id
+        self.replies: ReplayCache = ReplayCache(
+            window=replay_window, shared=self.store if shared_store else None
+        )
+        # static files, services may register more on self.assets
+        self.assets: AssetStore = AssetStore()
+        self.assets.register("gtu.gif", "gtu_s.gif")
         # route
         self.add_url_rule("/webhook", view_func=self.webhook, methods=["POST"])
+        self.add_url_rule("/static/<path:filename>", view_func=self.static_asset)
+        self.add_url_rule("/metrics", view_func=self.show_metrics)
+        self.add_url_rule("/export", view_func=self.export_day)
+        self._register_gauges()
         self.add_url_rule("/download/gtu.gif", view_func=self.download_gnome_throwup)
 
+    def _register_gauges(self) -> None:
+        outbound = self.syno_api.outbound
+        metrics.REGISTRY.gauge(
+            "synochat_outbound_queue_depth", "Queued outbound posts.", outbound.depth
+        )
+        metrics.REGISTRY.gauge(
+            "synochat_outbound_rejected",
+            "Posts dropped on a full queue.",
+            lambda: outbound.rejected,
+        )
+        metrics.REGISTRY.gauge(
+            "synochat_subscribers",
+            "Reminder subscribers.",
+            lambda: len(self.agnomer._sub_list),
+        )
+        if self.leases is not None:
+            leases = self.leases
+            metrics.REGISTRY.gauge(
+                "synochat_owned_partitions",
+                "Reminder partitions leased by this process.",
+                lambda: len(leases.owned()),
+            )
+
     def run_server(self) -> None:
         self.schedular.start()
         self.run(host=self.host, port=self.port)
 
     def parse_input(self, event: syno.BotEvent) -> syno.ReturnDict:
-        words: list[str] = event.text.split()
-        command = words[0]
-        ret_dict: syno.ReturnDict = {}
-        if command in self.agnomer.command_keys:
-            ret_dict = self.agnomer.parse_command(event)
-        else:
-            match command:
-                case "help":
-                    ret_dict["text"] = self.show_help(event)
-                case "service":
-                    ret_dict["text"] = self.show_service()
-                case "progress":
-                    ret_dict["text"] = self.show_progress(event)
-                case "sub":
-                    ret_dict["text"] = self.register_service(event, True)
-                case "unsub":
-                    ret_dict["text"] = self.register_service(event, False)
-                case _:
-                    ret_dict = self.check_input(event)
-
+        ret_dict: syno.ReturnDict = self.registry.dispatch(command.parse(event))
         logging.debug(f"parsed result:{ret_dict}")
         return ret_dict
 
-    def check_input(self, event: syno.PostEvent) -> syno.ReturnDict:
-        if (event.user_id not in self.agnomer._sub_id) or (
-            not self.agnomer._sub_list[event.user_id].wait_for_reply
+    def check_input(self, cmd: command.ParsedCommand) -> syno.ReturnDict:
+        if (cmd.user_id not in self.agnomer._sub_list) or (
+            not self.agnomer._sub_list[cmd.user_id].wait_for_reply
         ):
             # throw up and return app
-            words: list[str] = event.text.split()
-            command: str = words[0]
-            paras: List[str] = words[1:]
             ret_text: str = (
-                f'unknown command: {command}\nTry "help" for current available services'
+                f'unknown command: {cmd.name}\nTry "help" for current available services'
                 + " "
-                + " ".join(paras)
+                + " ".join(cmd.args)
             )
-            return {"text": ret_text, "file_url": f"{request.host_url}download/gtu.gif"}
-
-        self.agnomer._sub_notes[event.user_id][
-            self.agnomer._sub_list[event.user_id].idx_hour - 1
-        ] += "\n" + event.text
-        self.agnomer._sub_list[event.user_id].wait_for_reply = False
-        ret: str = (
-            f"Note taken for hour {self.agnomer._sub_list[event.user_id].idx_hour}"
-        )
+            return {
+                "text": ret_text,
+                "file_url": self.assets.url_for("gtu.gif", request.host_url),
+            }
 
-        return {"text": ret}
+        return {"text": self.agnomer.take_reply(cmd.event)}
 
     def show_help(self, event: syno.PostEvent) -> str:
         # show appended help
         # check sub for services
         help_note = SERVER_HELP_NOTE
-        if event.user_id in self.agnomer._sub_id:
+        if event.user_id in self.agnomer._sub_list:
             help_note += "\n" + self.agnomer.help
 
         return help_note
 
     def show_progress(self, event: syno.PostEvent) -> str:
         progress = SERVER_PROGRESS
-        if event.user_id in self.agnomer._sub_id:
+        if event.user_id in self.agnomer._sub_list:
             progress += "\n" + self.agnomer.progress
 
         return progress
@@ -139,19 +203,17 @@ class ServiceServer(Flask):
             str: service list
         """
         list_service = "Current available services:"
-        return list_service + SERVICES
-
-    def register_service(self, event: syno.PostEvent, sub: bool):
-        words: list[str] = event.text.split()
-        service_name: str = words[1] if len(words) > 1 else " "
-        match service_name:
-            case "reminder":
-                return self.agnomer.register(event, sub)
-            case _:
-                return (
-                    f"Unknow services:'{service_name}'.\n"
-                    "Use `services` to see availible services"
-                )
+        return list_service + self.registry.services_text() + "\n"
+
+    def register_service(self, cmd: command.ParsedCommand, sub: bool) -> str:
+        service_name: str = cmd.params["service"]
+        service: command.Service | None = self.registry.services.get(service_name)
+        if service is not None:
+            return service.register(cmd.event, sub)
+        return (
+            f"Unknow services:'{service_name}'.\n"
+            "Use `services` to see availible services"
+        )
 
     # routes
 
@@ -174,22 +236,65 @@ class ServiceServer(Flask):
             logging.error(f"empty event catched, may have a error? event:{event}")
         logging.debug(f"Raw event:{event}")
 
-        ret_dict: syno.ReturnDict = self.parse_input(event)
+        with self.profiler.section(), metrics.WEBHOOK_SECONDS.time():
+            ret_dict, replayed = self.replies.run(
+                (event.user_id, event.post_id), lambda: self.handle_event(event)
+            )
+        if replayed:
+            metrics.WEBHOOK_REPLAYS.inc()
+            logging.info(f"Replayed reply to retried post:{event.post_id}")
 
         return ret_dict
 
+    def handle_event(self, event: syno.BotEvent) -> syno.ReturnDict:
+        self.agnomer.sync()
+        return self.parse_input(event)
+
+    def show_metrics(self) -> Response:
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    def export_day(self) -> Response:
+        """Stream `?date=YYYY-MM-DD` as gzip NDJSON, or CSV with `&format=csv`."""
+        token: str = request.args.get("token", "")
+        auth: str = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            token = auth[len("Bearer ") :]
+        if not self.export_token or not hmac.compare_digest(
+            token.encode(), self.export_token.encode()
+        ):
+            return _plain("forbidden", 403)
+        try:
+            date = datetime.date.fromisoformat(request.args.get("date", ""))
+        except ValueError:
+            return _plain("date=YYYY-MM-DD required", 400)
+        fmt: str = request.args.get("format", "ndjson")
+        if fmt not in ("ndjson", "csv"):
+            return _plain("format is ndjson or csv", 400)
+        chunks = (
+            self.exporter.csv_chunks(date)
+            if fmt == "csv"
+            else self.exporter.ndjson_chunks(date)
+        )
+        if chunks is None:
+            return _plain("no export for that date", 404)
+        # no content length, so the body goes out with chunked transfer
+        return Response(
+            chunks,
+            mimetype="application/gzip",
+            headers={
+                "Content-Disposition": (
+                    f"attachment; filename=notes-{date.isoformat()}.{fmt}.gz"
+                )
+            },
+        )
+
+    def static_asset(self, filename: str) -> Response:
+        return self.assets.response(filename, request)
+
     def download_gnome_throwup(self) -> Response:
-        path: str = os.path.abspath("./assets/gtu_s.gif")
-        return send_file(path, as_attachment=False)
-
-
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.DEBUG)
-    scheduler = BackgroundScheduler()
-    service_server = ServiceServer(
-        name=__name__,
-        host=BOT_SERVER_CONF["ip"],
-        port=BOT_SERVER_CONF["port"],
-        bot_service_conf=BOT_CONF,
-    )
-    service_server.run_server()
+        # old url, kept for links already posted
+        return self.assets.response("gtu.gif", request)
+
+
+def _plain(text: str, status: int) -> Response:
+    return Response(text, status=status, mimetype="text/plain")
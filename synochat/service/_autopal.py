@@ -27,7 +27,7 @@ Logs:
     Deploy env for package XX verification.
 ```
 `amend` <Nth_HOUR> <LOG_MESSAGE>: Amend Nth_HOUR hour log with LOG_MESSAGE.
-    Nth_Hour: 1 ~ 10
+    Nth_Hour: 1 ~ 8
     LOG_MESSAGE: one or multiple lines of strings
     this will output the original log and log the next input. Enable after subscribe to hourly logging service.
     e.g. amend 2 "verifying bug #8964"
@@ -136,7 +136,7 @@ class HourReminder:
                     ),
                     idx_hour=0,
                 )
-                self._sub_notes[userid] = [""] * 10
+                self._sub_notes[userid] = [""] * subscribe.NOTE_HOURS
                 logging.info(
                     f"{username} subscribed, current sub list:{pprint.pformat(self._sub_list)}"
                 )
@@ -194,7 +194,7 @@ class HourReminder:
                 year=today.year, month=today.month, day=today.day, hour=10, minute=30
             )
             self._sub_list[uid].idx_hour = 0
-            self._sub_notes[uid] = [""] * 10
+            self._sub_notes[uid] = [""] * subscribe.NOTE_HOURS
             logging.debug(f"user:{self._sub_list[uid].u_name} have been clear")
         logging.info("Finished cleaning all the gnomes.")
 
@@ -259,7 +259,7 @@ class HourReminder:
         hour = int(words_space[1])
         log: str = " ".join(words_space[2:])
         # parse fail
-        if (not isinstance(hour, int)) or 0 > hour or hour > 10:
+        if (not isinstance(hour, int)) or not 1 <= hour <= subscribe.NOTE_HOURS:
             logging.warning(f"Amend command fail, with event:{event}")
             return f"Amend command fail, with hour:{hour} and log:{log}"
         else:
@@ -300,7 +300,7 @@ class HourReminder:
         is_sub: bool = True if event.user_id in self._sub_id else False
         if is_sub:
             word_count = 0
-            for i in range(10):
+            for i in range(subscribe.NOTE_HOURS):
                 word_count += len(self._sub_notes[event.user_id][i])
 
             if word_count > 1500:
@@ -312,7 +312,7 @@ class HourReminder:
                     ),
                     user_id=event.user_id,
                 )
-                for i in range(10):
+                for i in range(subscribe.NOTE_HOURS):
                     study_bot.web_post.send_message(
                         response_text=f"Hour {i+1}.\n    "
                         + self._sub_notes[event.user_id][i]
@@ -322,7 +322,7 @@ class HourReminder:
 
             else:
                 report: str = ""
-                for i in range(10):
+                for i in range(subscribe.NOTE_HOURS):
                     report += (
                         f"Hour {i+1}.\n    " + self._sub_notes[event.user_id][i] + "\n"
                     )
@@ -1,3 +1,4 @@
+import datetime
 import logging
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -6,13 +7,15 @@ from flask import Flask, jsonify, request
 from werkzeug.datastructures.structures import ImmutableMultiDict
 
 from synochat.model import syno
-from synochat.api.daily import RequestHandler, RequestParser
+from synochat.api.daily import ChallengeCache, LeetcodeError, RequestParser
 from synochat.service import study_bot, study_service
 
 app = Flask(__name__)
 
 scheduler = BackgroundScheduler()
 
+challenge_cache = ChallengeCache(path="leetcode.json")
+
 
 HELP_NOTE = """
 ~~ APE TOGETHER STRONG ~~
@@ -25,7 +28,11 @@ n <strings>: take note with bot, this will send message content to you directly
 
 def daily_leetcode() -> None:
     # Code to be executed by the cron job
-    challenge_info = RequestHandler.get_challenge_info()
+    try:
+        challenge_info = challenge_cache.get()
+    except LeetcodeError as e:
+        logging.error(f"Daily leetcode skipped: {e}")
+        return
     challenge = RequestParser.parse(challenge_info)
     study_service.web_post.send_message(
         response_text=f"""
@@ -44,9 +51,23 @@ scheduler.add_job(
     trigger=CronTrigger(hour=9, minute=30),
 )
 
+# fetch the new challenge right after leetcode's 00:00 UTC rollover
+scheduler.add_job(
+    func=challenge_cache.prewarm,
+    trigger=CronTrigger(hour=0, minute=1, timezone=datetime.timezone.utc),
+)
+
 
 def leetcode(user_id):
-    challenge_info = RequestHandler.get_challenge_info()
+    try:
+        challenge_info = challenge_cache.get()
+    except LeetcodeError as e:
+        logging.warning(f"lc failed: {e}")
+        study_bot.web_post.send_message(
+            user_id=user_id,
+            response_text="LeetCode is unreachable right now, try again later.",
+        )
+        return
     challenge = RequestParser.parse(challenge_info)
     study_bot.web_post.send_message(
         user_id=user_id,
@@ -62,6 +83,10 @@ Go for a shot!!!
 
 
 def throw_rock(target_name: str) -> None:
+    # mention the real username when the name is a known user or nickname
+    user = study_bot.users.find(target_name) if study_bot.users else None
+    if user is not None:
+        target_name = user.username
     study_service.web_post.send_message(response_text=f"@{target_name} rock!!!!")
 
 
@@ -0,0 +1,177 @@
+"""Command registry shared by the server and its services"""
+
+import dataclasses
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import metrics
+from model import syno
+
+_TOKEN = re.compile(r"\S+")
+
+HandlerResult = Union[syno.ReturnDict, str, None]
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ParsedCommand:
+    """An inbound message tokenized once
+
+    `name` is the first word, `args` the remaining words, and `rest(i)` the
+    raw text starting at argument i, with the user's spacing and newlines.
+    `params` holds the arguments converted by the command's schema.
+    """
+
+    event: syno.PostEvent
+    name: str
+    args: Tuple[str, ...]
+    starts: Tuple[int, ...]
+    params: Dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    @property
+    def user_id(self) -> int:
+        return self.event.user_id
+
+    @property
+    def username(self) -> str:
+        return self.event.username
+
+    def rest(self, idx: int = 0) -> str:
+        if idx >= len(self.args):
+            return ""
+        return self.event.text[self.starts[idx] :]
+
+
+def parse(event: syno.PostEvent) -> ParsedCommand:
+    matches = list(_TOKEN.finditer(event.text))
+    return ParsedCommand(
+        event=event,
+        name=matches[0].group() if matches else "",
+        args=tuple(match.group() for match in matches[1:]),
+        starts=tuple(match.start() for match in matches[1:]),
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class Arg:
+    """Argument schema entry
+
+    `kind` converts the token, `rest` takes the raw remaining text instead
+    of one token, and `required=False` leaves missing values as `default`.
+    """
+
+    name: str
+    kind: Callable[[str], Any] = str
+    rest: bool = False
+    required: bool = True
+    default: Any = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Command:
+    name: str
+    handler: Callable[[ParsedCommand], HandlerResult]
+    args: Tuple[Arg, ...] = ()
+
+    @property
+    def usage(self) -> str:
+        words: List[str] = [self.name]
+        for arg in self.args:
+            name: str = arg.name.upper()
+            words.append(f"<{name}>" if arg.required else f"[{name}]")
+        return " ".join(words)
+
+    def bind(self, cmd: ParsedCommand) -> ParsedCommand:
+        """Convert the arguments by schema, raising ValueError on mismatch."""
+        params: Dict[str, Any] = {}
+        for idx, arg in enumerate(self.args):
+            if idx >= len(cmd.args):
+                if arg.required:
+                    raise ValueError(f"missing {arg.name}")
+                params[arg.name] = arg.default
+                continue
+            raw: str = cmd.rest(idx) if arg.rest else cmd.args[idx]
+            params[arg.name] = arg.kind(raw)
+        return dataclasses.replace(cmd, params=params)
+
+
+@dataclasses.dataclass(frozen=True)
+class Service:
+    name: str
+    description: str
+    register: Callable[[syno.PostEvent, bool], str]
+
+
+class CommandRegistry:
+    """Name -> command table with a fallback for unknown commands
+
+    Registries can be merged with `include`, so the server dispatches every
+    service's commands with a single dict lookup.
+    """
+
+    def __init__(
+        self, fallback: Optional[Callable[[ParsedCommand], HandlerResult]] = None
+    ) -> None:
+        self.commands: Dict[str, Command] = {}
+        self.services: Dict[str, Service] = {}
+        self.fallback: Optional[Callable[[ParsedCommand], HandlerResult]] = fallback
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.commands
+
+    def add(
+        self,
+        name: str,
+        handler: Callable[[ParsedCommand], HandlerResult],
+        args: Tuple[Arg, ...] = (),
+    ) -> Command:
+        if name in self.commands:
+            raise KeyError(f"command {name} already registered")
+        command = Command(name, handler, args)
+        self.commands[name] = command
+        return command
+
+    def add_service(
+        self,
+        name: str,
+        description: str,
+        register: Callable[[syno.PostEvent, bool], str],
+    ) -> None:
+        self.services[name] = Service(name, description, register)
+
+    def include(self, other: "CommandRegistry") -> None:
+        for name, command in other.commands.items():
+            if name in self.commands:
+                raise KeyError(f"command {name} already registered")
+            self.commands[name] = command
+        self.services.update(other.services)
+
+    def dispatch(self, cmd: ParsedCommand) -> syno.ReturnDict:
+        command: Optional[Command] = self.commands.get(cmd.name)
+        # free text is labelled as one value to keep the metric small
+        label: str = cmd.name if command is not None else "(fallback)"
+        with metrics.COMMAND_SECONDS.time(label):
+            if command is None:
+                if self.fallback is None:
+                    return {"text": f"unknown command: {cmd.name}"}
+                return _as_return(self.fallback(cmd))
+            try:
+                bound: ParsedCommand = command.bind(cmd)
+            except ValueError as e:
+                logging.debug(f"Bad arguments for {cmd.name}: {e}")
+                return {"text": f"Usage: `{command.usage}`"}
+            return _as_return(command.handler(bound))
+
+    def services_text(self) -> str:
+        return "".join(
+            f"\n*{service.name}* : {service.description}"
+            for service in self.services.values()
+        )
+
+
+def _as_return(result: HandlerResult) -> syno.ReturnDict:
+    if result is None:
+        return {}
+    if isinstance(result, str):
+        return {"text": result}
+    return result
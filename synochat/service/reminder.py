@@ -2,16 +2,22 @@ import datetime
 import enum
 import logging
 import pprint
-from typing import Dict, List, Set
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple
 
-from api.daily import RequestHandler, RequestParser
+import export
+from api.daily import ChallengeCache, LeetcodeError, RequestParser
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from model import subscribe, syno
+from model import lease, store, subscribe, syno, zones
 from model.lc import Challenge
+from profiling import MemoryTracker, Profiler
+from service import command
 
 HELP_NOTE = """
 ~~ *Hourly Reminder Gnome Usage* ~~
+Reminders follow the timezone of your Synology Chat profile and go out
+on weekdays from 09:00 to 22:00 your time.
 `on`: Start daily timer.
 `log`: Show accumulated log of today.
     In the format of below:
@@ -26,14 +32,18 @@ Logs:
     Deploy env for package XX verification.
 ```
 `amend <Nth_HOUR> <LOG_MESSAGE>`: Amend Nth_HOUR hour log with LOG_MESSAGE.
-    Nth_Hour: 1 ~ 10
+    Nth_Hour: 1 ~ 8
     LOG_MESSAGE: one or multiple lines of strings
     this will output the original log and log the next input.
     e.g. amend 2 "verifying bug #8964"
 >   Amend hour 2 log from "" to "verifying bug #8964"
 `skip` : skip today, used for skipping days when taking day off.
 `note <TEXT>`: Append TEXT to current hour's note.
-~lc: Get daily supplement~
+`lc`: Get today's leetcode challenge.
+`lc <YYYY-MM-DD>`: Get the challenge of a past day.
+`lc history`: List recent challenges.
+`lc tag <TAG_SLUG>`: List recent challenges with a topic tag, e.g. `lc tag array`.
+`lc difficulty <LEVEL>`: List recent Easy, Medium or Hard challenges.
 """
 
 
@@ -48,6 +58,18 @@ To-Do list:
     * add skip feature
 """
 
+NOTE_HOURS = subscribe.NOTE_HOURS
+
+REMIND_TEXT = "This is your hourly reminder, what were you doing for the last hour?"
+
+
+LEETCODE_USAGE = "lc [YYYY-MM-DD | history | tag <TAG_SLUG> | difficulty <LEVEL>]"
+
+SERVICE_NAME = "reminder"
+SERVICE_DESCRIPTION = (
+    "hourly remind for work summary, for more info, see `help` after subscribe."
+)
+
 
 class CommandEnum(enum.Enum):
     LOG = "log"
@@ -57,127 +79,382 @@ class CommandEnum(enum.Enum):
     SKIP = "skip"
     DEV_PRINT_STATUS = "_print_status"
     DEV_SET_ON = "_set_on"
+    DEV_PROFILE = "_profile"
+    DEV_MEM = "_mem"
     LEETCODE = "lc"
 
 
+STATUS_USAGE = "_print_status [users <PAGE> | user <ID>]"
+STATUS_PAGE_SIZE = 20
+# synology cuts longer messages
+STATUS_MAX_CHARS = 1500
+
+# dev commands restricted to admin_ids
+ADMIN_COMMANDS = (CommandEnum.DEV_PROFILE, CommandEnum.DEV_MEM)
+
+
 class Agnomeing:
-    def __init__(self, chat_api: syno.Bot, scheduler: BackgroundScheduler) -> None:
+    def __init__(
+        self,
+        chat_api: syno.Bot,
+        scheduler: BackgroundScheduler,
+        sub_store: store.SubStore | None = None,
+        challenge_cache: ChallengeCache | None = None,
+        profiler: Profiler | None = None,
+        admin_ids: Iterable[int] = (),
+        zone_windows: Mapping[str, Tuple[str, str]] | None = None,
+        leases: lease.PartitionLeases | None = None,
+        exporter: export.DayExporter | None = None,
+    ) -> None:
         self.chat_api: syno.Bot = chat_api
         self.scheduler: BackgroundScheduler = scheduler
         self.help: str = HELP_NOTE
         self.progress: str = PROGRESS
         self.commands = CommandEnum
-        self.command_keys: List[str] = [command.value for command in self.commands]
-        self._sub_list: Dict[int, subscribe.SubInfo] = {}
-        self._sub_id: Set[int] = set()
-        self._sub_notes: Dict[int, List[str]] = {}
+        self.admin_ids: frozenset[int] = frozenset(admin_ids)
+        self.profiler: Profiler = profiler if profiler is not None else Profiler()
+        self.memory: MemoryTracker = MemoryTracker(self._memory_sizes)
+        self.registry: command.CommandRegistry = self._build_registry()
+        self._sub_list: subscribe.SubTable = subscribe.SubTable()
+        # per-timezone due indexes, rows of an older day roll over when touched
+        self.zones: zones.ZoneIndex = zones.ZoneIndex(zone_windows)
+        # with leases, only users of the partitions this node holds are due here
+        self.leases: lease.PartitionLeases | None = leases
+        # finished days are exported right before a row rolls over
+        self.exporter: export.DayExporter | None = exporter
+        self._seen_change: int = 0
+        # webhook threads and the scheduler sync concurrently
+        self._sync_lock = threading.Lock()
+        # the table above acts as read cache of the store
+        self.store: store.SubStore = (
+            sub_store if sub_store is not None else store.SubStore(":memory:")
+        )
+        self._load_store()
+        self.challenge_cache: ChallengeCache = (
+            challenge_cache if challenge_cache is not None else ChallengeCache()
+        )
         # routines
         self.scheduler.add_job(
             name="DailyGnome",
-            func=self.angnome,
-            trigger=CronTrigger(day_of_week="mon-fri", second=1),
+            func=self.profiler.wrap(self.angnome),
+            # zones open on their own weekdays, so run every day
+            trigger=CronTrigger(second=1),
         )
 
         self.scheduler.add_job(
-            name="ResetDailyGnome",
-            func=self.clean_gnome,
-            trigger=CronTrigger(day_of_week="mon-fri", hour=7, minute=30),
+            name="FlushGnome",
+            func=self.profiler.wrap(self.store.flush),
+            trigger="interval",
+            seconds=self.store.flush_interval,
         )
 
+        if self.leases is not None:
+            self.scheduler.add_job(
+                name="RenewLeases",
+                func=self.renew_leases,
+                trigger="interval",
+                seconds=self.leases.ttl / 3,
+                # first renewal as soon as the scheduler starts, however late
+                next_run_time=datetime.datetime.now(),
+                misfire_grace_time=None,
+            )
+
+        # leetcode rolls the daily challenge over at 00:00 UTC
+        self.scheduler.add_job(
+            name="PrewarmLeetcode",
+            func=self.profiler.wrap(self.challenge_cache.prewarm),
+            trigger=CronTrigger(hour=0, minute=1, timezone=datetime.timezone.utc),
+        )
+
+    def _load_store(self) -> None:
+        self._seen_change = self.store.last_change()
+        self._sub_list = self.store.load(NOTE_HOURS)
+        self.zones.clear()
+        now: datetime.datetime = datetime.datetime.now()
+        for subinfo in self._sub_list.values():
+            self._schedule_next(subinfo, now)
+
+    def sync(self) -> None:
+        """Pick up subscribers changed by other processes sharing the store."""
+        if not self.store.shared:
+            return
+        with self._sync_lock:
+            seq, u_ids = self.store.changes_since(self._seen_change)
+            if u_ids is None:
+                self._load_store()
+                return
+            self._seen_change = seq
+            now: datetime.datetime = datetime.datetime.now()
+            for uid in u_ids:
+                loaded = self.store.load_user(uid, NOTE_HOURS)
+                old: subscribe.SubRow | None = self._sub_list.get(uid)
+                if old is not None:
+                    self.zones.remove(uid, old.tz)
+                    self._sub_list.remove(uid)
+                if loaded is None:
+                    continue
+                subinfo: subscribe.SubRow = self._sub_list.add(*loaded)
+                self._schedule_next(subinfo, now)
+
+    def _owns(self, u_id: int) -> bool:
+        return self.leases is None or self.leases.owns(u_id)
+
+    def renew_leases(self) -> None:
+        """Renew partition leases, then pick up or drop the users that moved."""
+        leases: lease.PartitionLeases | None = self.leases
+        if leases is None:
+            return
+        gained, lost = leases.renew()
+        if not gained and not lost:
+            return
+        now: datetime.datetime = datetime.datetime.now()
+        partitions: int = leases.partitions
+        for subinfo in self._sub_list.values():
+            part: int = lease.partition_of(subinfo.u_id, partitions)
+            if part in gained:
+                self._schedule_next(subinfo, now)
+            elif part in lost:
+                self.zones.remove(subinfo.u_id, subinfo.tz)
+
+    def _user_tz(self, u_id: int) -> str:
+        users: syno.UserDirectory | None = self.chat_api.users
+        user: syno.UserData | None = users.get(u_id) if users is not None else None
+        if user is None:
+            return zones.LOCAL
+        return user.user_props.timezoneUTC or zones.LOCAL
+
+    def _roll(self, subinfo: subscribe.SubRow, now: datetime.datetime) -> bool:
+        """Start the current work day for a row left on an older one.
+
+        The user's timezone is looked up again, so a changed profile moves
+        them to another bucket from the next day on.
+        """
+        zone: zones.Zone = self.zones.zone(subinfo.tz)
+        day: int = zone.work_day(now)
+        if subinfo.day == day:
+            return False
+        tz: str = self._user_tz(subinfo.u_id)
+        if tz != subinfo.tz:
+            self.zones.remove(subinfo.u_id, subinfo.tz)
+            subinfo.tz = tz
+            zone = self.zones.zone(tz)
+            day = zone.work_day(now)
+            if subinfo.day == day:
+                # still the same day over there, only change buckets
+                self.store.upsert_sub(subinfo)
+                self._schedule_next(subinfo, now)
+                return False
+        on_time: datetime.datetime = zone.on_time(day)
+        if not self._sub_list.roll(
+            subinfo.u_id, day, on_time, NOTE_HOURS, before=self._export
+        ):
+            return False
+        self.store.roll_user(subinfo.u_id, on_time, day, tz)
+        self._schedule_next(subinfo, now)
+        logging.debug(f"User:{subinfo.u_name} rolled over to a new day")
+        return True
+
+    def _export(self, subinfo: subscribe.SubRow) -> None:
+        if self.exporter is not None and subinfo.day:
+            self.exporter.add(
+                export.record(datetime.date.fromordinal(subinfo.day), subinfo)
+            )
+
+    def _local(self, u_id: int, moment: datetime.datetime) -> datetime.datetime:
+        """`moment` in the wall-clock time of subscriber `u_id`."""
+        return self.zones.zone(self._sub_list[u_id].tz).local(moment)
+
     # routines
     def angnome(self) -> None:
-        # hourly reminder
+        # hourly reminder, only open zones and their due users are touched
+        self.sync()
         now: datetime.datetime = datetime.datetime.now()
-        if now.hour < 22 and now.hour > 8:
-            logging.info("Start angnome")
-            remind_list: List[subscribe.SubInfo] = []
-            for _uid, subinfo in self._sub_list.items():
-                diff_time: float = (now - subinfo.on_time).total_seconds()
-                logging.debug(
-                    f"User:{subinfo.u_name}, idx_hour:{subinfo.idx_hour} total diff second:{diff_time}"
-                )
-                if (diff_time > 3600) and (diff_time % 3600 < 60):
-                    remind_list.append(subinfo)
-            logging.info(f"Found user needs to remind:{remind_list}")
-            for subinfo in remind_list:
-                self.chat_api.web_post.send_message(
-                    response_text="This is your hourly reminder, what were you doing for the last hour?",
-                    user_id=subinfo.u_id,
-                )
-                self._sub_list[subinfo.u_id].wait_for_reply = True
-                self._sub_list[subinfo.u_id].idx_hour = int(
-                    (now - subinfo.on_time).total_seconds() // 3600
-                )
-                logging.debug(
-                    f"User:{subinfo.u_name} data after remind:{pprint.pformat(self._sub_list[subinfo.u_id])}"
-                )
-                logging.info(f"Reminded user:{subinfo.u_name} to log hour status")
-
-    def clean_gnome(self) -> None:
-        logging.debug("Start cleaning gnome")
-        for uid in self._sub_id:
-            today: datetime.datetime = datetime.datetime.today()
-            self._sub_list[uid].on_time = datetime.datetime(
-                year=today.year, month=today.month, day=today.day, hour=10, minute=30
+        remind_list: List[subscribe.SubRow] = []
+        for zone in self.zones.open_zones(now):
+            for uid in zone.due.pop_due(now):
+                subinfo: subscribe.SubRow | None = self._sub_list.get(uid)
+                if subinfo is None or not self._owns(uid) or self._roll(subinfo, now):
+                    continue
+                self._schedule_next(subinfo, now)
+                remind_list.append(subinfo)
+        if not remind_list:
+            return
+        logging.info(f"Found user needs to remind:{remind_list}")
+        self.chat_api.web_post.send_batch(
+            (subinfo.u_id, REMIND_TEXT) for subinfo in remind_list
+        )
+        # a late run catches up to the latest passed hour
+        self._sub_list.mark_reminded((subinfo.u_id for subinfo in remind_list), now)
+        for subinfo in remind_list:
+            logging.debug(
+                f"User:{subinfo.u_name} data after remind:{pprint.pformat(subinfo)}"
             )
-            self._sub_list[uid].idx_hour = 0
-            self._sub_notes[uid] = [""] * 8
-            logging.debug(f"User:{self._sub_list[uid].u_name} have been clear")
-        logging.info("Finished cleaning all the gnomes.")
+            logging.info(f"Reminded user:{subinfo.u_name} to log hour status")
+        self.store.upsert_subs(remind_list)
 
-    def parse_command(self, event: syno.BotEvent) -> syno.ReturnDict:
-        ret_dict: syno.ReturnDict = {}
-        # Check if sub
-        if event.user_id not in self._sub_id:
-            logging.debug(f"User:{event.username} is not sub")
-            ret_dict["text"] = 'You are not subscribed yet, see "help" for usage'
-            return ret_dict
-
-        # parse command
-        words: list[str] = event.text.split()
-        command: str = words[0]
-        match command:
-            case self.commands.LOG.value:
-                self.show_log(event)
-                ret_dict["text"] = ""
-            case self.commands.AMEND.value:
-                ret_dict["text"] = self.amend(event)
-            case self.commands.ON.value:
-                ret_dict["text"] = self.onboard(event)
-            case self.commands.NOTE.value:
-                ret_dict["text"] = self.note(event)
-            case self.commands.SKIP.value:
-                ret_dict["text"] = "NotImplementedError"
-            case self.commands.DEV_PRINT_STATUS.value:
-                self._print_status(event)
-            case self.commands.DEV_SET_ON.value:
-                ret_dict["text"] = self._set_on_time(event)
-            case self.commands.LEETCODE.value:
-                ret_dict["text"] = self.leetcode()
-            case _:
-                ret_dict["text"] = self.check_for_note(event)
+    def _schedule_next(
+        self, subinfo: subscribe.SubRow, now: datetime.datetime
+    ) -> None:
+        """Queue the user's first whole-hour mark after `now` in their zone."""
+        if not self._owns(subinfo.u_id):
+            return
+        passed_hours: int = max(
+            0, int((now - subinfo.on_time).total_seconds() // 3600)
+        )
+        self.zones.schedule(
+            subinfo.u_id,
+            subinfo.tz,
+            subinfo.on_time + datetime.timedelta(hours=passed_hours + 1),
+        )
+
+    def _build_registry(self) -> command.CommandRegistry:
+        registry = command.CommandRegistry(
+            fallback=self._subscribed(self.check_for_note)
+        )
+        cmds = self.commands
+        handlers = {
+            cmds.LOG: self._log,
+            cmds.AMEND: self.amend,
+            cmds.ON: lambda cmd: self.onboard(cmd.event),
+            cmds.NOTE: self.note,
+            cmds.SKIP: lambda cmd: "NotImplementedError",
+            cmds.DEV_PRINT_STATUS: self._print_status,
+            cmds.DEV_SET_ON: self._set_on_time,
+            cmds.DEV_PROFILE: self._profile,
+            cmds.DEV_MEM: self._mem,
+            cmds.LEETCODE: self.leetcode,
+        }
+        args = {
+            cmds.AMEND: (
+                command.Arg("hour", int),
+                command.Arg("log", rest=True, required=False, default=""),
+            ),
+            cmds.DEV_SET_ON: tuple(
+                command.Arg(name, int)
+                for name in ("year", "month", "day", "hour", "minute")
+            ),
+            cmds.DEV_PRINT_STATUS: (
+                command.Arg("view", required=False, default=""),
+                command.Arg("number", int, required=False, default=0),
+            ),
+            cmds.DEV_PROFILE: (command.Arg("action"),),
+            cmds.DEV_MEM: (command.Arg("action"),),
+            cmds.LEETCODE: (
+                command.Arg("query", required=False, default=""),
+                command.Arg("value", required=False, default=""),
+            ),
+        }
+        for cmd_enum, handler in handlers.items():
+            guard = self._admin if cmd_enum in ADMIN_COMMANDS else self._subscribed
+            registry.add(cmd_enum.value, guard(handler), args.get(cmd_enum, ()))
+        registry.add_service(SERVICE_NAME, SERVICE_DESCRIPTION, self.register)
+        return registry
+
+    def _subscribed(
+        self, handler: Callable[[command.ParsedCommand], command.HandlerResult]
+    ) -> Callable[[command.ParsedCommand], command.HandlerResult]:
+        def guarded(cmd: command.ParsedCommand) -> command.HandlerResult:
+            subinfo: subscribe.SubRow | None = self._sub_list.get(cmd.user_id)
+            if subinfo is None:
+                logging.debug(f"User:{cmd.username} is not sub")
+                return 'You are not subscribed yet, see "help" for usage'
+            self._roll(subinfo, datetime.datetime.now())
+            return handler(cmd)
+
+        return guarded
 
+    def _admin(
+        self, handler: Callable[[command.ParsedCommand], command.HandlerResult]
+    ) -> Callable[[command.ParsedCommand], command.HandlerResult]:
+        def guarded(cmd: command.ParsedCommand) -> command.HandlerResult:
+            if cmd.user_id not in self.admin_ids:
+                logging.warning(f"User:{cmd.username} tried admin command {cmd.name}")
+                return "This command is for admins only."
+            return handler(cmd)
+
+        return guarded
+
+    def parse_command(self, event: syno.BotEvent) -> syno.ReturnDict:
+        ret_dict: syno.ReturnDict = self.registry.dispatch(command.parse(event))
         logging.debug(f"Parsed result:{ret_dict}")
         return ret_dict
 
-    def _print_status(self, event: syno.PostEvent) -> None:
-        self.chat_api.web_post.send_message(
-            response_text=pprint.pformat(self._sub_id),
-            user_id=event.user_id,
-        )
-        self.chat_api.web_post.send_message(
-            response_text=pprint.pformat(self._sub_list),
-            user_id=event.user_id,
-        )
-        self.chat_api.web_post.send_message(
-            response_text=pprint.pformat(self._sub_notes),
-            user_id=event.user_id,
+    def _print_status(self, cmd: command.ParsedCommand) -> str:
+        view: str = cmd.params["view"]
+        number: int = cmd.params["number"]
+        if view == "":
+            summary: Dict[str, Any] = self._sub_list.summary()
+            summary["due_entries"] = len(self.zones)
+            summary["zones"] = self.zones.summary()
+            if self.leases is not None:
+                summary["node"] = self.leases.node
+                summary["partitions"] = sorted(self.leases.owned())
+            summary["outbound"] = self.chat_api.outbound.stats()
+            return pprint.pformat(summary) + (
+                "\n`_print_status users <PAGE>` or `_print_status user <ID>` for more"
+            )
+        if view == "users":
+            page: int = max(1, number)
+            pages: int = max(1, -(-len(self._sub_list) // STATUS_PAGE_SIZE))
+            rows = self._sub_list.page(
+                (page - 1) * STATUS_PAGE_SIZE, STATUS_PAGE_SIZE
+            )
+            lines: List[str] = [f"Users page {page}/{pages}:"]
+            for row in rows:
+                lines.append(
+                    f"{row.u_id} {row.u_name} on:{row.on_time:%m-%d %H:%M} "
+                    f"hour:{row.idx_hour} waiting:{row.wait_for_reply} "
+                    f"notes:{row.notes.char_count}"
+                )
+            return "\n".join(lines)
+        if view == "user":
+            found: subscribe.SubRow | None = self._sub_list.get(number)
+            if found is None:
+                return f"No subscriber with id {number}"
+            notes: str = pprint.pformat(found.notes)
+            if len(notes) > STATUS_MAX_CHARS:
+                notes = notes[:STATUS_MAX_CHARS] + "..."
+            return f"{pprint.pformat(found.to_info())}\n{notes}"
+        return f"Usage: `{STATUS_USAGE}`"
+
+    def _profile(self, cmd: command.ParsedCommand) -> str:
+        action: str = cmd.params["action"]
+        if action == "start":
+            if not self.profiler.start():
+                return "Profiler is already running."
+            return "Profiling webhooks and scheduled jobs, `_profile stop` to dump."
+        if action == "stop":
+            return self.profiler.stop(top=10) or "Profiler is not running."
+        return "Usage: `_profile start|stop`"
+
+    def _mem(self, cmd: command.ParsedCommand) -> str:
+        action: str = cmd.params["action"]
+        if action == "snapshot":
+            return self.memory.snapshot()
+        if action == "diff":
+            return self.memory.diff()
+        if action == "stop":
+            return self.memory.stop()
+        return "Usage: `_mem snapshot|diff|stop`"
+
+    def _memory_sizes(self) -> Dict[str, Any]:
+        buffered: int = sum(
+            len(getattr(handler, "buffer", ()))
+            for handler in logging.getLogger().handlers
         )
+        return {
+            "subscribers": len(self._sub_list),
+            "sub_table_bytes": self._sub_list.nbytes(),
+            "note_chars": sum(row.notes.char_count for row in self._sub_list.values()),
+            "due_entries": len(self.zones),
+            "outbound_depth": self.chat_api.outbound.depth(),
+            "logging_buffered_records": buffered,
+        }
 
     def register(self, event: syno.PostEvent, sub: bool):
         # check if sub
         username, userid = event.username, event.user_id
-        is_sub: bool = True if event.user_id in self._sub_id else False
+        is_sub: bool = True if event.user_id in self._sub_list else False
         # determin what to do
         if sub:
             if is_sub:
@@ -186,35 +463,36 @@ class Agnomeing:
                 )
                 output = 'You are already subscribed. if you need to unsubscribe, use "unsub"'
             else:
-                today: datetime.datetime = datetime.datetime.today()
-                self._sub_id.add(userid)
-                self._sub_list[userid] = subscribe.SubInfo(
-                    wait_for_reply=False,
-                    wait_time=datetime.datetime.now(),
-                    u_id=userid,
-                    u_name=username,
-                    sub_time=event.timestamp,
-                    on_time=datetime.datetime(
-                        year=today.year,
-                        month=today.month,
-                        day=today.day,
-                        hour=10,
-                        minute=30,
+                tz: str = self._user_tz(userid)
+                zone: zones.Zone = self.zones.zone(tz)
+                day: int = zone.work_day(datetime.datetime.now())
+                subinfo = self._sub_list.add(
+                    subscribe.SubInfo(
+                        wait_for_reply=False,
+                        wait_time=datetime.datetime.now(),
+                        u_id=userid,
+                        u_name=username,
+                        sub_time=event.timestamp,
+                        on_time=zone.on_time(day),
+                        idx_hour=0,
+                        day=day,
+                        tz=tz,
                     ),
-                    idx_hour=0,
+                    subscribe.NoteBuffer(NOTE_HOURS),
                 )
-                self._sub_notes[userid] = [""] * 8
+                self.store.upsert_sub(subinfo)
+                self._schedule_next(subinfo, datetime.datetime.now())
                 logging.info(
-                    f"{username} subscribed, current sub list:{pprint.pformat(self._sub_list)}"
+                    f"{username} subscribed, current sub list:{self._sub_list}"
                 )
                 output = "Subscribe successful. see help for usage"
         else:
             if is_sub:
-                self._sub_id.remove(userid)
-                self._sub_list.pop(userid)
-                self._sub_notes.pop(userid)
+                self.zones.remove(userid, self._sub_list[userid].tz)
+                self._sub_list.remove(userid)
+                self.store.delete_sub(userid)
                 logging.info(
-                    f"{username} unsubscribed, current sub list:{pprint.pformat(self._sub_list)}"
+                    f"{username} unsubscribed, current sub list:{self._sub_list}"
                 )
                 output = "Unubscribed successful."
             else:
@@ -225,72 +503,85 @@ class Agnomeing:
 
         return output
 
-    def check_for_note(self, event: syno.PostEvent) -> str:  # FIXME
-        if self._sub_list[event.user_id].wait_for_reply:
-            self._sub_notes[event.user_id][
-                self._sub_list[event.user_id].idx_hour - 1
-            ] += "\n" + event.text
-            self._sub_list[event.user_id].wait_for_reply = False
-            ret: str = f"Note taken for hour {self._sub_list[event.user_id].idx_hour}"
+    def take_reply(self, event: syno.PostEvent) -> str:
+        """Store a reply to the hourly reminder as the last hour's note
+
+        Args:
+            event (syno.PostEvent): reply event of a user waiting for reply
+
+        Returns:
+            str: request result
+        """
+        subinfo: subscribe.SubRow = self._sub_list[event.user_id]
+        self._roll(subinfo, datetime.datetime.now())
+        # the hour just reminded of, rows stored before the cap may be past it
+        hour: int = min(max(subinfo.idx_hour, 1), NOTE_HOURS)
+        subinfo.notes.append(hour - 1, event.text)
+        subinfo.wait_for_reply = False
+        self.store.append_note(event.user_id, hour - 1, event.text)
+        self.store.upsert_sub(subinfo)
+        return f"Note taken for hour {hour}"
+
+    def check_for_note(self, cmd: command.ParsedCommand) -> str:  # FIXME
+        if self._sub_list[cmd.user_id].wait_for_reply:
+            ret: str = self.take_reply(cmd.event)
         else:
-            words: list[str] = event.text.split()
-            command: str = words[0]
-            paras: List[str] = words[1:]
             ret = (
-                f'Unknown command: {command}\nTry "help" for current available services'
+                f'Unknown command: {cmd.name}\nTry "help" for current available services'
             )
-            ret += " " + " ".join(paras)
+            ret += " " + " ".join(cmd.args)
 
         return ret
 
-    def note(self, event: syno.PostEvent) -> str:
+    def note(self, cmd: command.ParsedCommand) -> str:
         """Append note on current time
 
         Args:
-            event (chat_event.PostEvent): request event for this event
+            cmd (command.ParsedCommand): parsed request of this event
 
         Returns:
             str: request result
         """
-        note: str = " ".join(event.text.split()[1:])
-        ap_note: str = event.timestamp.strftime("%H:%M") + " " + note
-        idx_hour: int = self._sub_list[event.user_id].idx_hour
-        if self._sub_notes[event.user_id][idx_hour]:
-            self._sub_notes[event.user_id][idx_hour] = (
-                self._sub_notes[event.user_id][idx_hour] + "\n" + ap_note
-            )
-        else:
-            self._sub_notes[event.user_id][idx_hour] = ap_note
+        event: syno.PostEvent = cmd.event
+        note: str = " ".join(cmd.args)
+        ap_note: str = (
+            self._local(event.user_id, event.timestamp).strftime("%H:%M") + " " + note
+        )
+        # the hour in progress, past the last slot notes go to the last hour
+        idx_hour: int = min(self._sub_list[event.user_id].idx_hour, NOTE_HOURS - 1)
+        self._sub_list[event.user_id].notes.append(idx_hour, ap_note)
+        self.store.append_note(event.user_id, idx_hour, ap_note)
 
-        return f"On time:{self._sub_list[event.user_id].idx_hour + 1} log note:{note}"
+        return f"On time:{idx_hour + 1} log note:{note}"
 
-    def amend(self, event: syno.PostEvent) -> str:
-        # parse to get hour idx, log
+    def amend(self, cmd: command.ParsedCommand) -> str:
+        event: syno.PostEvent = cmd.event
         logging.debug(f"user:{event.username} request for amend")
-        words_space: List[str] = event.text.split(" ")
-        hour = int(words_space[1])
-        log: str = " ".join(words_space[2:])
+        hour: int = cmd.params["hour"]
+        log: str = cmd.params["log"]
         # parse fail
-        if (not isinstance(hour, int)) or 0 > hour or hour > 10:
+        if not 1 <= hour <= NOTE_HOURS:
             logging.warning(f"Amend command fail, with event:{event}")
             return f"Amend command fail, with hour:{hour} and log:{log}"
         else:
             # amend txt on command [idx-1]
-            self._sub_notes[event.user_id][hour - 1] = log
+            self._sub_list[event.user_id].notes.replace(hour - 1, log)
+            self.store.set_note(event.user_id, hour - 1, log)
             logging.info(f"user:{event.username} amended hour:{hour-1} log.")
             return f'Amend hour:{hour} log. use "log" to see the latest version'
 
-    def _set_on_time(self, event: syno.PostEvent) -> str:
-        words_space: List[str] = event.text.split(" ")
-        set_datetime = datetime.datetime(
-            int(words_space[1]),
-            int(words_space[2]),
-            int(words_space[3]),
-            int(words_space[4]),
-            int(words_space[5]),
-        )
+    def _set_on_time(self, cmd: command.ParsedCommand) -> str:
+        event: syno.PostEvent = cmd.event
+        try:
+            set_datetime = datetime.datetime(**cmd.params)
+        except ValueError as e:
+            # each field is an int, but together they may be no valid date
+            logging.debug(f"Bad on time for {cmd.name}: {e}")
+            return f"Usage: `{self.registry.commands[cmd.name].usage}`"
 
         self._sub_list[event.user_id].on_time = set_datetime
+        self.store.upsert_sub(self._sub_list[event.user_id])
+        self._schedule_next(self._sub_list[event.user_id], datetime.datetime.now())
         return (
             f"Set user:{event.username} on time:{self._sub_list[event.user_id].on_time}"
         )
@@ -300,54 +591,105 @@ class Agnomeing:
         now: datetime.datetime = datetime.datetime.now()
         self._sub_list[event.user_id].on_time = now
         self._sub_list[event.user_id].idx_hour = 0
+        self.store.upsert_sub(self._sub_list[event.user_id])
+        self._schedule_next(self._sub_list[event.user_id], now)
         logging.info(f"User:{event.username} set on board time:{now}")
-        return f"set on board time: {now.hour}:{now.minute}"
+        local: datetime.datetime = self._local(event.user_id, now)
+        return f"set on board time: {local.hour}:{local.minute}"
 
-    def show_log(self, event: syno.PostEvent) -> None:
-        word_count = 0
-        for i in range(8):
-            word_count += len(self._sub_notes[event.user_id][i])
+    def _log(self, cmd: command.ParsedCommand) -> str:
+        # the report is posted by show_log, the reply itself stays empty
+        self.show_log(cmd.event)
+        return ""
 
-        if word_count > 1500:
+    def show_log(self, event: syno.PostEvent) -> None:
+        notes: subscribe.NoteBuffer = self._sub_list[event.user_id].notes
+        on_time: datetime.datetime = self._local(
+            event.user_id, self._sub_list[event.user_id].on_time
+        )
+        if notes.char_count > 1500:
             self.chat_api.web_post.send_message(
                 response_text=(
                     "This is your latest report: \n"
                     f"You already on board for {self._sub_list[event.user_id].idx_hour} hours\n"
-                    f"Your on time is set at {self._sub_list[event.user_id].on_time}\n"
+                    f"Your on time is set at {on_time}\n"
                 ),
                 user_id=event.user_id,
             )
-            for i in range(8):
+            for i in range(NOTE_HOURS):
                 self.chat_api.web_post.send_message(
-                    response_text=f"`{i+1}.`\n"
-                    + self._sub_notes[event.user_id][i]
-                    + "\n",
+                    response_text=f"`{i+1}.`\n" + notes.render(i) + "\n",
                     user_id=event.user_id,
                 )
 
         else:
             report: str = ""
-            for i in range(8):
-                report += f"`{i+1}.`\n" + self._sub_notes[event.user_id][i] + "\n"
+            for i in range(NOTE_HOURS):
+                report += f"`{i+1}.`\n" + notes.render(i) + "\n"
             self.chat_api.web_post.send_message(
                 response_text=(
                     "This is your latest report: \n"
                     f"You already on board for {self._sub_list[event.user_id].idx_hour} hours\n"
-                    f"Your on time is set at {self._sub_list[event.user_id].on_time}\n"
+                    f"Your on time is set at {on_time}\n"
                     + report
                 ),
                 user_id=event.user_id,
             )
 
-    def leetcode(self):
-        challenge_info = RequestHandler.get_challenge_info()
+    def leetcode(self, cmd: command.ParsedCommand) -> str:
+        query: str = cmd.params["query"]
+        value: str = cmd.params["value"]
+        history = self.challenge_cache.history
+        if not query:
+            return self._today_challenge()
+        if query == "history":
+            return _challenge_list("Recent challenges", history.latest())
+        if query == "tag" and value:
+            return _challenge_list(f"Challenges tagged {value}", history.by_tag(value))
+        if query == "difficulty" and value:
+            return _challenge_list(
+                f"{value.capitalize()} challenges", history.by_difficulty(value)
+            )
+        try:
+            date: str = datetime.date.fromisoformat(query).isoformat()
+        except ValueError:
+            return f"Usage: `{LEETCODE_USAGE}`"
+        challenge: Challenge | None = history.get(date)
+        if challenge is None:
+            return f"No challenge recorded for {date}"
+        return _challenge_text(f"Challenge of {date}", challenge)
+
+    def _today_challenge(self) -> str:
+        try:
+            challenge_info = self.challenge_cache.get()
+        except LeetcodeError as e:
+            logging.warning(f"lc failed: {e}")
+            return "LeetCode is unreachable right now, try `lc` again later."
         challenge: Challenge = RequestParser.parse(challenge_info)
-        response_text: str = f"""
-Today's challenge: {challenge.title}
+        header: str = "Today's challenge"
+        if not self.challenge_cache.is_today(challenge_info):
+            # degraded: leetcode is down, serve the last known challenge
+            header = f"LeetCode is unreachable, last known challenge ({challenge.date})"
+        return _challenge_text(header, challenge) + "Go for a shot!!!\n"
+
+
+def _challenge_text(header: str, challenge: Challenge) -> str:
+    return f"""
+{header}: {challenge.title}
 Difficulty: {challenge.difficulty}
 ID: {challenge.question_id}
 Link: {challenge.problem_link}
 Success rate: {challenge.ac_rate}
-Go for a shot!!!
 """
-        return response_text
+
+
+def _challenge_list(header: str, challenges: List[Challenge]) -> str:
+    if not challenges:
+        return f"{header}: none recorded yet"
+    lines: List[str] = [f"{header}:"]
+    for challenge in challenges:
+        lines.append(
+            f"{challenge.date} [{challenge.difficulty}] "
+            f"{challenge.question_id}. {challenge.title} {challenge.problem_link}"
+        )
+    return "\n".join(lines)
@@ -40,6 +40,30 @@ CHANNEL_SERVICE_CONF = ServiceConf(
     }
 )
 
+BOT_SERVER_CONF = ServerConf(port=5000, ip="0.0.0.0")
+
+# subscriber database, shared by all workers in production
+STORE_PATH = "synochat.db"
+# lock electing the one worker that runs the scheduler, keep it on local disk
+SCHEDULER_LOCK = STORE_PATH + ".scheduler.lock"
+
+# user ids allowed to run the `_profile` and `_mem` dev commands
+ADMIN_IDS: list[int] = []
+
+# reminder hours per timezone ("HH:MM" local start and end), default 09:00-22:00
+# e.g. {"Europe/Berlin": ("08:00", "18:00")}
+REMINDER_WINDOWS: dict[str, tuple[str, str]] = {}
+
+# split reminders across instances sharing the store, 0 for a single instance
+REMINDER_PARTITIONS = 0
+# lease database on storage shared by all instances, default STORE_PATH.leases
+LEASE_PATH: str | None = None
+# a dead instance's partitions are taken over about this many seconds later
+LEASE_SECONDS = 30.0
+
+# secret for downloading notes from /export?date=YYYY-MM-DD, None disables it
+EXPORT_TOKEN: str | None = None
+
 STUDY_CONF = ServerConf(port=5008, ip="192.168.1.103")
 
 BOT_CONF_AUTOPAL = ServerConf(port=5009, ip="192.168.1.103")
@@ -0,0 +1,92 @@
+"""In-memory static assets served with content-hash ETags"""
+
+import dataclasses
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from flask import Request, Response
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# content-addressed urls never change content, so cache them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Asset:
+    name: str
+    data: bytes
+    mimetype: str
+    digest: str
+
+    @property
+    def hashed_name(self) -> str:
+        """File name carrying the content hash, e.g. gtu.3f2a9c1b04d7.gif"""
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.digest[:12]}{ext}"
+
+
+class AssetStore:
+    """Static files loaded once and answered from memory
+
+    Every asset is reachable by its plain name and by a content-addressed
+    name (`hashed_name`). Both carry the content hash as ETag and answer
+    conditional requests with 304. Hashed names are cached as immutable for a
+    year; plain names must be revalidated, so a changed file shows up at once.
+    Services register their own files with `register` and link them with
+    `url_for`.
+    """
+
+    def __init__(self, root: str = ASSET_DIR) -> None:
+        self.root: str = root
+        self._assets: Dict[str, Asset] = {}
+        self._hashed: Dict[str, Asset] = {}
+
+    def register(self, name: str, path: str) -> Asset:
+        """Load `path` (relative to root) and publish it as `name`."""
+        with open(os.path.join(self.root, path), "rb") as asset_file:
+            data: bytes = asset_file.read()
+        mimetype: str = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        asset = Asset(
+            name=name,
+            data=data,
+            mimetype=mimetype,
+            digest=hashlib.sha256(data).hexdigest(),
+        )
+        old: Optional[Asset] = self._assets.get(name)
+        if old is not None:
+            self._hashed.pop(old.hashed_name, None)
+        self._assets[name] = asset
+        self._hashed[asset.hashed_name] = asset
+        logging.info(f"Registered asset {name} as {asset.hashed_name} ({len(data)}B)")
+        return asset
+
+    def get(self, name: str) -> Optional[Asset]:
+        return self._assets.get(name)
+
+    def url_for(self, name: str, host_url: str) -> str:
+        """Content-addressed url of asset `name` under `host_url`."""
+        return f"{host_url}static/{self._assets[name].hashed_name}"
+
+    def response(self, filename: str, request: Request) -> Response:
+        """Serve `filename` honouring If-None-Match, 404 when unknown."""
+        asset: Optional[Asset] = self._hashed.get(filename)
+        immutable: bool = asset is not None
+        if asset is None:
+            asset = self._assets.get(filename)
+        if asset is None:
+            return Response("not found", status=404, mimetype="text/plain")
+
+        response = Response(asset.data, mimetype=asset.mimetype)
+        response.set_etag(asset.digest)
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        response.make_conditional(request)
+        return response
@@ -0,0 +1,117 @@
+"""Entry points for running the bot server
+
+Development, single process with Flask's built-in server:
+    python wsgi.py
+
+Production, pre-forked workers under gunicorn (run from this directory):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+In production every worker serves webhooks from the shared SQLite store,
+while only the worker holding the scheduler lock runs the reminder jobs.
+If that worker dies the lock is released and another worker takes over.
+The shared store uses a rollback journal rather than WAL.
+
+To run several instances, put the store on shared storage and set
+REMINDER_PARTITIONS: the scheduler process of every instance then leases a
+share of the subscriber partitions (model.lease) and only reminds those.
+Point SCHEDULER_LOCK at local disk then: each instance needs a scheduler
+of its own, and `flock` is unreliable on NFS/SMB.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+from typing import IO, Dict, List, Optional, Tuple
+
+import service_conf
+from server import ServiceServer
+
+STORE_PATH: str = getattr(service_conf, "STORE_PATH", "synochat.db")
+ADMIN_IDS: List[int] = getattr(service_conf, "ADMIN_IDS", [])
+REMINDER_WINDOWS: Dict[str, Tuple[str, str]] = getattr(
+    service_conf, "REMINDER_WINDOWS", {}
+)
+REMINDER_PARTITIONS: int = getattr(service_conf, "REMINDER_PARTITIONS", 0)
+LEASE_PATH: Optional[str] = getattr(service_conf, "LEASE_PATH", None)
+LEASE_SECONDS: float = getattr(service_conf, "LEASE_SECONDS", 30.0)
+EXPORT_TOKEN: Optional[str] = getattr(service_conf, "EXPORT_TOKEN", None)
+SCHEDULER_LOCK: str = getattr(
+    service_conf, "SCHEDULER_LOCK", STORE_PATH + ".scheduler.lock"
+)
+
+
+class SchedulerLeader:
+    """Start the server's scheduler in the one process holding a file lock
+
+    Every worker polls a non-blocking `flock` on `lock_path`; the holder
+    starts the scheduler and keeps the lock until it exits. Keep `lock_path`
+    on local disk, flock over NFS/SMB may not exclude or may never release.
+    """
+
+    def __init__(
+        self, server: ServiceServer, lock_path: str, retry: float = 5.0
+    ) -> None:
+        self.server: ServiceServer = server
+        self.lock_path: str = lock_path
+        self.retry: float = retry
+        self._lock_file: Optional[IO] = None
+        self._stop = threading.Event()
+
+    def try_acquire(self) -> bool:
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.try_acquire():
+                logging.info(f"Process:{os.getpid()} owns the scheduler")
+                self.server.schedular.start()
+                return
+            self._stop.wait(self.retry)
+
+    def start(self) -> None:
+        threading.Thread(
+            target=self._run, name="scheduler-leader", daemon=True
+        ).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def create_app(shared_store: bool = True) -> ServiceServer:
+    return ServiceServer(
+        name=__name__,
+        host=service_conf.BOT_SERVER_CONF["ip"],
+        port=service_conf.BOT_SERVER_CONF["port"],
+        bot_service_conf=service_conf.BOT_CONF,
+        store_path=STORE_PATH,
+        shared_store=shared_store,
+        admin_ids=ADMIN_IDS,
+        reminder_windows=REMINDER_WINDOWS,
+        partitions=REMINDER_PARTITIONS,
+        lease_path=LEASE_PATH,
+        lease_seconds=LEASE_SECONDS,
+        export_token=EXPORT_TOKEN,
+    )
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.DEBUG)
+    create_app(shared_store=False).run_server()
+
+
+if __name__ == "__main__":
+    main()
+else:
+    # imported by a WSGI server, one app per worker process
+    app: ServiceServer = create_app()
+    # module level reference, the lock is held as long as this object lives
+    leader = SchedulerLeader(app, SCHEDULER_LOCK)
+    leader.start()
@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+
+from model import subscribe
+
+NOW = datetime.datetime(2024, 7, 1, 9, 5)
+
+
+def at(minutes: int) -> datetime.datetime:
+    return NOW + datetime.timedelta(minutes=minutes)
+
+
+def test_due_index_reschedule_after_pop_skips_stale_entry() -> None:
+    index = subscribe.DueIndex()
+    index.schedule(1, at(145))  # subscribe, due 11:30
+    index.schedule(1, at(60))  # on at 9:05, due 10:05
+    assert index.pop_due(at(60)) == [1]
+    index.schedule(1, at(120))  # next hour, 11:05
+    assert index.pop_due(at(120)) == [1]
+    index.schedule(1, at(180))
+    # the subscribe-time entry at 11:30 is stale
+    assert index.pop_due(at(145)) == []
+    assert index.pop_due(at(180)) == [1]
+
+
+def test_due_index_reschedule_after_remove_skips_stale_entry() -> None:
+    index = subscribe.DueIndex()
+    index.schedule(1, at(10))
+    index.remove(1)
+    index.schedule(1, at(60))
+    assert 1 in index
+    assert index.pop_due(at(10)) == []
+    assert index.pop_due(at(60)) == [1]
+    assert len(index) == 0
+
+
+def sub_info(u_id: int, on_time: datetime.datetime) -> subscribe.SubInfo:
+    return subscribe.SubInfo(
+        wait_for_reply=False,
+        wait_time=on_time,
+        u_id=u_id,
+        u_name=f"user{u_id}",
+        sub_time=on_time,
+        on_time=on_time,
+        idx_hour=0,
+    )
+
+
+def test_mark_reminded_caps_idx_hour() -> None:
+    table = subscribe.SubTable()
+    table.add(sub_info(1, NOW), subscribe.NoteBuffer(subscribe.NOTE_HOURS))
+    table.mark_reminded([1], at(60 * 3))
+    assert table[1].idx_hour == 3
+    table.mark_reminded([1], at(60 * 12))
+    assert table[1].idx_hour == subscribe.NOTE_HOURS
+    assert table[1].wait_for_reply
+
+
+def test_note_buffer_rejects_out_of_range_hour() -> None:
+    notes = subscribe.NoteBuffer(subscribe.NOTE_HOURS)
+    notes.append(subscribe.NOTE_HOURS - 1, "last")
+    assert notes.render(subscribe.NOTE_HOURS - 1) == "last"
+    for hour in (-1, subscribe.NOTE_HOURS):
+        with pytest.raises(ValueError, match="out of range"):
+            notes.append(hour, "late")
+        with pytest.raises(ValueError, match="out of range"):
+            notes.replace(hour, "late")
+    assert notes.char_count == len("last")